@@ -0,0 +1,318 @@
+"""
+Benchmarks for the invoice parser, rule-based handlers and models.
+
+Generates seeded synthetic ledgers, times every InvoiceParser query and
+every rule-based handler, and times model loading and inference with
+tiny randomly initialized models built locally, so it runs offline.
+Results are written as JSON so runs can be compared across commits.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import date, timedelta
+import numpy as np
+from intent_router import dispatch, route
+from invoice_parser import InvoiceParser
+from invoice_shards import ShardedInvoiceParser
+from invoice_snapshot import load_snapshot, write_snapshot
+from invoice_store import InvoiceStore
+
+
+def generate_ledger(count, vendors=100, due_spread=60, history=365, seed=0, chunk_size=1000000):
+    """Build a store of count synthetic invoices.
+
+    Vendor popularity follows a Zipf-like curve over the given number of
+    vendors. Invoice dates fall in the last history days and due dates up
+    to due_spread days after them, so due-date queries relative to today
+    find matches.
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array([f"Vendor {i:05d}" for i in range(vendors)])
+    weights = 1.0 / np.arange(1, vendors + 1)
+    weights /= weights.sum()
+    first_day = np.datetime64(date.today() - timedelta(days=history), 'D')
+    store = InvoiceStore()
+    store.reserve(count)
+    
+    for start in range(0, count, chunk_size):
+        n = min(chunk_size, count - start)
+        invoice_date = first_day + rng.integers(0, history, n)
+        store.extend_columns(
+            vendor=names[rng.choice(vendors, n, p=weights)],
+            invoice_number=[f"INV-{i:08d}" for i in range(start + 1, start + n + 1)],
+            invoice_date=invoice_date,
+            due_date=invoice_date + rng.integers(0, due_spread + 1, n),
+            total=np.round(rng.lognormal(7.0, 1.0, n), 2),
+            paid=rng.random(n) < 0.3
+        )
+    return store
+
+
+def summarize(samples):
+    """Latency percentiles in milliseconds for a list of durations in seconds."""
+    ms = np.asarray(samples) * 1000
+    return {
+        'runs': len(ms),
+        'p50_ms': round(float(np.percentile(ms, 50)), 4),
+        'p99_ms': round(float(np.percentile(ms, 99)), 4),
+        'mean_ms': round(float(ms.mean()), 4),
+        'max_ms': round(float(ms.max()), 4)
+    }
+
+
+def measure(fn, repeat=50, budget=2.0):
+    """Time fn up to repeat times, stopping early once budget seconds are spent."""
+    samples = []
+    deadline = time.perf_counter() + budget
+    while len(samples) < repeat:
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+        if time.perf_counter() > deadline:
+            break
+    return summarize(samples)
+
+
+def parser_cases(parser):
+    """Name -> zero-argument call for every InvoiceParser query."""
+    vendor = parser.invoices.vendors[0]
+    today = date.today()
+    median = float(np.median(parser.invoices.total))
+    return {
+        'get_invoices_due_between': lambda: parser.get_invoices_due_between(today, today + timedelta(days=30)),
+        'get_invoices_due_in_days': lambda: parser.get_invoices_due_in_days(7),
+        'get_invoice_by_vendor': lambda: parser.get_invoice_by_vendor(vendor),
+        'find_vendor': lambda: parser.find_vendor(f"{vendor} last month"),
+        'get_invoices_by_vendor': lambda: parser.get_invoices_by_vendor(vendor),
+        'get_vendor_summary': lambda: parser.get_vendor_summary(vendor),
+        'get_vendor_totals': lambda: parser.get_vendor_totals(),
+        'get_invoices_above_amount': lambda: parser.get_invoices_above_amount(median * 10),
+        'get_total_amount': lambda: parser.get_total_amount(),
+        'get_top_invoices': lambda: parser.get_top_invoices(5),
+        'get_ranked_invoices': lambda: parser.get_ranked_invoices('due_date', 5, largest=False),
+        'get_ranked_invoices_vendor': lambda: parser.get_ranked_invoices('total', 5, vendor_name=vendor),
+        'get_ranked_vendors': lambda: parser.get_ranked_vendors('open_balance', 5),
+        'get_ledger_summary': lambda: parser.get_ledger_summary(),
+        'get_overdue_invoices': lambda: parser.get_overdue_invoices(),
+    }
+
+
+def handler_questions(store):
+    """Intent -> a question that routes to it."""
+    median = float(np.median(store.total))
+    return {
+        'due_in_days': "How many invoices are due in the next 7 days?",
+        'vendor_total': f"What is the total value of the invoice from {store.vendors[-1]}?",
+        'vendors_above_amount': f"List all vendors with invoices > ${median * 10:,.0f}",
+        'overdue': "What invoices are overdue?",
+        'show_all': "Show me all invoices",
+        'invoice_rank': "Which vendor has the highest invoice?",
+        'vendor_rank': "Who owes the most money?",
+        'invoice_count': "How many unpaid invoices are there?",
+        'amount_sum': "What is the total of all invoices?",
+    }
+
+
+def bench_handlers(bot, store, repeat, budget):
+    """Route and answer one question per rule-based intent, bypassing the cache."""
+    results = {}
+    for intent, question in handler_questions(store).items():
+        assert route(question)[0] == intent, question
+        results[intent] = measure(lambda: dispatch(bot, *route(question)), repeat, budget)
+    return results
+
+
+def bench_ledger(count, vendors, due_spread, seed, repeat, budget, shards=None):
+    """Benchmark the parser and rule-based handlers on one synthetic ledger."""
+    from chatbot import InvoiceChatbot
+    from chatbot_simple import SimpleLLMChatbot
+    
+    start = time.perf_counter()
+    store = generate_ledger(count, vendors, due_spread, seed=seed)
+    generated = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    parser = InvoiceParser(store)
+    indexed = time.perf_counter() - start
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ledger.snap')
+        start = time.perf_counter()
+        write_snapshot(parser, path, fingerprint='benchmark')
+        written = time.perf_counter() - start
+        snapshot = measure(lambda: InvoiceParser(load_snapshot(path)), repeat, budget)
+    
+    result = {
+        'invoices': count,
+        'vendors': len(store.vendors),
+        'due_spread': due_spread,
+        'generate_s': round(generated, 4),
+        'index_build_s': round(indexed, 4),
+        'snapshot_write_s': round(written, 4),
+        'snapshot_load': snapshot,
+        'parser': {name: measure(fn, repeat, budget) for name, fn in parser_cases(parser).items()},
+        'handlers': {}
+    }
+    if shards:
+        start = time.perf_counter()
+        sharded = ShardedInvoiceParser(store, shards)
+        # Shards index in the background; the first query waits for them
+        sharded.get_total_amount()
+        indexed = time.perf_counter() - start
+        result['sharded'] = {
+            'shards': shards,
+            'index_build_s': round(indexed, 4),
+            'parser': {name: measure(fn, repeat, budget) for name, fn in parser_cases(sharded).items()}
+        }
+        sharded.close()
+    for name, cls in (('simple', SimpleLLMChatbot), ('full', InvoiceChatbot)):
+        bot = cls(invoices=store)
+        result['handlers'][name] = bench_handlers(bot, store, repeat, budget)
+    return result, store
+
+
+def build_tiny_models(path):
+    """Save a tiny random DistilBERT Q&A model and GPT-2 generator under path."""
+    import string
+    import torch
+    from tokenizers import ByteLevelBPETokenizer
+    from transformers import (DistilBertConfig, DistilBertForQuestionAnswering, DistilBertTokenizerFast,
+                              GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast)
+    
+    torch.manual_seed(0)
+    qa_path = os.path.join(path, 'qa')
+    os.makedirs(qa_path)
+    words = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list(string.printable[:94]) + [
+        "invoice", "vendor", "due", "date", "total", "amount", "paid", "from", "the", "what", "who", "which"]
+    with open(os.path.join(qa_path, 'vocab.txt'), 'w') as f:
+        f.write("\n".join(words))
+    tokenizer = DistilBertTokenizerFast(os.path.join(qa_path, 'vocab.txt'), do_lower_case=False)
+    config = DistilBertConfig(vocab_size=len(words), dim=32, hidden_dim=64, n_layers=2, n_heads=2)
+    DistilBertForQuestionAnswering(config).save_pretrained(qa_path)
+    tokenizer.save_pretrained(qa_path)
+    
+    gen_path = os.path.join(path, 'gen')
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(["Invoice Date Due Total Vendor User question Assistant"], vocab_size=300,
+                            special_tokens=["<|endoftext|>"], show_progress=False)
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=bpe._tokenizer, eos_token="<|endoftext|>",
+                                        bos_token="<|endoftext|>")
+    config = GPT2Config(vocab_size=len(tokenizer), n_embd=32, n_layer=2, n_head=2, n_positions=1024,
+                        bos_token_id=tokenizer.eos_token_id, eos_token_id=tokenizer.eos_token_id)
+    GPT2LMHeadModel(config).save_pretrained(gen_path)
+    tokenizer.save_pretrained(gen_path)
+    return qa_path, gen_path
+
+
+def model_questions(store, n=32):
+    """Questions no rule answers, so they go to the model."""
+    rows = np.linspace(0, len(store) - 1, n).astype(int)
+    return [f"Who sent invoice {store.invoice_numbers[row]}?" for row in rows]
+
+
+def bench_models(store, repeat, budget, options=None):
+    """Benchmark loading and inference of tiny local models on a ledger."""
+    from chatbot_simple import SimpleLLMChatbot
+    from cpu_inference import InferenceOptions
+    from llm_handler import LocalLLMHandler
+    
+    options = options or InferenceOptions()
+    questions = model_questions(store)
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        qa_path, gen_path = build_tiny_models(path)
+        
+        # Loaded through the bots' own loaders, registered under the tiny
+        # models' paths so they never stand in for the real models
+        start = time.perf_counter()
+        bot = SimpleLLMChatbot(invoices=store, inference=options, qa_model_name=qa_path)
+        bot.qa_model.get()
+        load = time.perf_counter() - start
+        cycle = iter(questions * (repeat // len(questions) + 1))
+        results['options'] = options.describe()
+        results['qa'] = {
+            'load_s': round(load, 4),
+            'first_question': measure(lambda: bot.try_qa_model(questions[0]), 1),
+            'per_question': measure(lambda: bot.try_qa_model(next(cycle)), repeat, budget),
+            f'batch_of_{len(questions)}': measure(lambda: bot.answer_model_batch(questions), 5, budget)
+        }
+        bot.close()
+        
+        start = time.perf_counter()
+        handler = LocalLLMHandler(model_name=gen_path, invoices=store, inference=options)
+        handler.lazy_pipeline.get()
+        load = time.perf_counter() - start
+        cycle = iter(questions * (repeat // len(questions) + 1))
+        results['generation'] = {
+            'load_s': round(load, 4),
+            'per_question': measure(lambda: handler.generate_response(next(cycle)), repeat, budget)
+        }
+        handler.close()
+    return results
+
+
+def environment():
+    """Describe the code and machine a run was made on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the invoice chatbot on synthetic ledgers.")
+    parser.add_argument('--invoices', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="ledger sizes to benchmark (1000 to 10000000)")
+    parser.add_argument('--vendors', type=int, default=100, help="number of distinct vendors")
+    parser.add_argument('--due-spread', type=int, default=60, help="max days between invoice and due date")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=50, help="max timed runs per case")
+    parser.add_argument('--budget', type=float, default=2.0, help="seconds after which a case stops repeating")
+    parser.add_argument('--shards', type=int, help="also benchmark the parser sharded across this many processes")
+    parser.add_argument('--no-model', action='store_true', help="skip the model benchmarks")
+    parser.add_argument('--quantize', choices=['int8'], help="benchmark models quantized to int8")
+    parser.add_argument('--compile', choices=['torchscript', 'compile'], help="benchmark compiled models")
+    parser.add_argument('--threads', type=int, help="torch intra-op threads for the model benchmarks")
+    parser.add_argument('--output', default='benchmark.json', help="where to write the JSON results")
+    args = parser.parse_args()
+    
+    report = {'environment': environment(), 'ledgers': []}
+    store = None
+    for count in args.invoices:
+        print(f"⏱️ Benchmarking {count:,} invoices...")
+        result, ledger = bench_ledger(count, args.vendors, args.due_spread, args.seed, args.repeat, args.budget,
+                                      args.shards)
+        report['ledgers'].append(result)
+        if store is None:
+            store = ledger
+    
+    if not args.no_model and store is not None:
+        print(f"⏱️ Benchmarking tiny models on {len(store):,} invoices...")
+        try:
+            from cpu_inference import InferenceOptions
+            options = InferenceOptions(quantize=args.quantize, compile=args.compile, threads=args.threads)
+            report['models'] = bench_models(store, args.repeat, args.budget, options)
+        except ImportError as e:
+            print(f"⚠️ Skipping model benchmarks: {e}")
+    
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
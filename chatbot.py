@@ -2,117 +2,101 @@
 Invoice Chatbot - CLI interface for querying invoice data.
 """
 
-import re
-from invoice_parser import InvoiceParser
+from intent_router import HANDLERS, PAGED, dispatch, route
+from invoice_answers import InvoiceAnswers
+from invoice_listing import iter_lines
+from invoice_shards import make_parser
 from llm_handler import LocalLLMHandler
+from metrics import count, registry
+from response_cache import ResponseCache, TransientResponse
 
 
-class InvoiceChatbot:
-    def __init__(self):
-        self.parser = InvoiceParser()
-        self.llm_handler = LocalLLMHandler()
+class InvoiceChatbot(InvoiceAnswers):
+    def __init__(self, warm_up=False, cache_size=256, cache_ttl=300, invoices=None, inference=None):
+        self.parser = make_parser(invoices)
+        self.llm_handler = LocalLLMHandler(warm_up=warm_up, invoices=self.parser.invoices, inference=inference)
+        self.response_cache = ResponseCache(cache_size, cache_ttl)
         self.running = True
+        self.last_listing = None
     
     def process_query(self, query):
         """Process user query and return appropriate response."""
-        query_lower = query.lower()
+        intent, slots = route(query)
         
         # Check for exit commands
-        if any(word in query_lower for word in ['quit', 'exit', 'bye']):
+        if intent == 'exit':
             self.running = False
             return "Goodbye! Thanks for using the Invoice Chatbot."
-        
-        # Show all invoices
-        if 'show' in query_lower and 'all' in query_lower:
-            return self.show_all_invoices()
-        
-        # Due in next X days
-        if 'due' in query_lower and ('next' in query_lower or 'days' in query_lower):
-            days_match = re.search(r'(\d+)\s*days?', query_lower)
-            days = int(days_match.group(1)) if days_match else 7
-            return self.handle_due_invoices(days)
-        
-        # Total value from specific vendor
-        if 'total' in query_lower and 'from' in query_lower:
-            vendor_match = re.search(r'from\s+(\w+)', query_lower)
-            if vendor_match:
-                vendor = vendor_match.group(1)
-                return self.handle_vendor_total(vendor)
-        
-        # List vendors above amount
-        if 'list' in query_lower and 'vendors' in query_lower and '>' in query:
-            amount_match = re.search(r'>\s*\$?(\d+(?:,\d{3})*)', query)
-            if amount_match:
-                amount = float(amount_match.group(1).replace(',', ''))
-                return self.handle_vendors_above_amount(amount)
-        
-        # Overdue invoices
-        if 'overdue' in query_lower:
-            return self.handle_overdue_invoices()
+        if intent in PAGED:
+            return self.answer_query(query, intent, slots)
+        
+        # Serve repeated questions from the cache while the data is unchanged
+        version = self.parser.invoices.version
+        response = self.response_cache.get(query, version)
+        if response is None:
+            response = self.answer_query(query, intent, slots)
+            self.response_cache.put(query, version, response)
+        return response
+    
+    def stream_query(self, query):
+        """Process a query, yielding listings line by line and LLM answers piece by piece."""
+        intent, slots = route(query)
+        if intent == 'exit':
+            self.running = False
+            yield "Goodbye! Thanks for using the Invoice Chatbot."
+            return
+        if intent in PAGED:
+            yield from iter_lines(dispatch(self, intent, slots, stream=True))
+            return
+        
+        version = self.parser.invoices.version
+        response = self.response_cache.get(query, version)
+        if response is not None:
+            yield response
+            return
+        
+        # Only LLM answers are streamed; everything else arrives whole
+        if intent in HANDLERS or not self.llm_handler.is_available():
+            response = self.answer_query(query, intent, slots)
+            self.response_cache.put(query, version, response)
+            yield response
+            return
+        
+        count('resolved.model')
+        pieces = []
+        for piece in self.llm_handler.stream_response(query):
+            pieces.append(piece)
+            yield piece
+        if not any(isinstance(piece, TransientResponse) for piece in pieces):
+            self.response_cache.put(query, version, "".join(pieces).strip())
+    
+    def answer_query(self, query, intent, slots):
+        """Answer a routed query with rule-based handlers, falling back to the LLM."""
+        response = dispatch(self, intent, slots)
+        if response is not None:
+            return response
         
         # If no rule-based match, try LLM
         if self.llm_handler.is_available():
+            count('resolved.model')
             return self.llm_handler.generate_response(query)
         
         # Help or unknown query
-        return self.show_help()
-    
-    def handle_due_invoices(self, days=7):
-        """Handle queries about invoices due in X days."""
-        due_invoices = self.parser.get_invoices_due_in_days(days)
-        
-        if not due_invoices:
-            return f"No invoices are due in the next {days} days."
-        
-        count = len(due_invoices)
-        response = f"{count} invoice{'s' if count != 1 else ''} due in the next {days} days:\n"
-        
-        for inv in due_invoices:
-            response += f"- {inv['vendor']}, due {self.parser.format_date(inv['due_date'])}, {self.parser.format_currency(inv['total'])}\n"
-        
-        return response.strip()
+        count('resolved.help')
+        return TransientResponse(self.show_help())
     
-    def handle_vendor_total(self, vendor):
-        """Handle queries about total from specific vendor."""
-        invoice = self.parser.get_invoice_by_vendor(vendor)
-        
-        if not invoice:
-            return f"No invoice found from {vendor}."
-        
-        return f"Total value of invoice from {invoice['vendor']}: {self.parser.format_currency(invoice['total'])}"
+    def answer_model_batch(self, queries):
+        """Answer queries that need the LLM, in order."""
+        if not self.llm_handler.is_available():
+            count('resolved.help', len(queries))
+            return [TransientResponse(self.show_help()) for _ in queries]
+        count('resolved.model', len(queries))
+        return [self.llm_handler.generate_response(query) for query in queries]
     
-    def handle_vendors_above_amount(self, amount):
-        """Handle queries about vendors with invoices above amount."""
-        invoices = self.parser.get_invoices_above_amount(amount)
-        
-        if not invoices:
-            return f"No vendors have invoices above {self.parser.format_currency(amount)}."
-        
-        response = f"Vendors with invoices > {self.parser.format_currency(amount)}:\n"
-        for inv in invoices:
-            response += f"- {inv['vendor']} ({self.parser.format_currency(inv['total'])})\n"
-        
-        return response.strip()
-    
-    def handle_overdue_invoices(self):
-        """Handle queries about overdue invoices."""
-        overdue = self.parser.get_overdue_invoices()
-        
-        if not overdue:
-            return "No invoices are overdue."
-        
-        response = f"{len(overdue)} overdue invoice{'s' if len(overdue) != 1 else ''}:\n"
-        for inv in overdue:
-            response += f"- {inv['vendor']}, due {self.parser.format_date(inv['due_date'])}, {self.parser.format_currency(inv['total'])}\n"
-        
-        return response.strip()
-    
-    def show_all_invoices(self):
-        """Show all invoices."""
-        response = "All invoices:\n"
-        for inv in self.parser.invoices:
-            response += f"- {inv['vendor']}: {inv['invoice_number']}, due {self.parser.format_date(inv['due_date'])}, {self.parser.format_currency(inv['total'])}\n"
-        return response.strip()
+    def close(self):
+        """Release this bot's hold on the shared local model and stop any parser workers."""
+        self.llm_handler.close()
+        self.parser.close()
     
     def show_help(self):
         """Show help message with example queries."""
@@ -123,6 +107,11 @@ class InvoiceChatbot:
 • "List all vendors with invoices > $2,000"
 • "Show me all invoices"
 • "What invoices are overdue?"
+• "Which vendor has the highest invoice?"
+• "Who owes the most money?"
+• "How many unpaid invoices are there?"
+
+Long lists are shown a page at a time; say "more" for the next page.
 
 Type 'quit', 'exit', or 'bye' to exit."""
     
@@ -131,11 +120,13 @@ Type 'quit', 'exit', or 'bye' to exit."""
         print("🤖 Invoice Chatbot")
         print("=" * 50)
         
-        # Show LLM status
-        if self.llm_handler.is_available():
+        # Show LLM status without forcing the model to load
+        if self.llm_handler.is_loaded():
             print("✅ Local AI model loaded - I can handle natural language queries!")
+        elif self.llm_handler.lazy_pipeline.is_loading():
+            print("⏳ Local AI model loading in the background - rule-based queries work right away")
         else:
-            print("⚠️ Local AI model not available - using rule-based responses only")
+            print("💤 Local AI model will load on the first natural language query")
         
         print("Ask me about your invoices! Type 'help' for examples.\n")
         
@@ -145,16 +136,23 @@ Type 'quit', 'exit', or 'bye' to exit."""
                 if not query:
                     continue
                 
-                response = self.process_query(query)
-                print(f"Bot: {response}\n")
+                print("Bot: ", end="", flush=True)
+                for piece in self.stream_query(query):
+                    print(piece, end="", flush=True)
+                print("\n")
                 
             except KeyboardInterrupt:
                 print("\n\nGoodbye! Thanks for using the Invoice Chatbot.")
                 break
             except Exception as e:
                 print(f"Bot: Sorry, I encountered an error: {e}\n")
+        
+        registry.flush()
 
 
 if __name__ == "__main__":
-    chatbot = InvoiceChatbot()
-    chatbot.run()
\ No newline at end of file
+    chatbot = InvoiceChatbot(warm_up=True)
+    try:
+        chatbot.run()
+    finally:
+        chatbot.close()
\ No newline at end of file
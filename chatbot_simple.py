@@ -2,151 +2,272 @@
 Lightweight version using a smaller, faster model for better performance.
 """
 
-import re
 import json
-from transformers import pipeline
-from invoice_parser import InvoiceParser
+from cpu_inference import InferenceOptions, optimize_model
+from intent_router import PAGED, dispatch, route
+from invoice_answers import InvoiceAnswers
+from invoice_listing import iter_lines
+from invoice_retrieval import retriever_for
+from invoice_shards import make_parser
+from metrics import count, registry, timed
+from model_registry import models
+from qa_inference import answer_questions, encode_context
+from response_cache import ResponseCache, TransientResponse
 
 
-class SimpleLLMChatbot:
-    def __init__(self):
-        self.parser = InvoiceParser()
+CONTEXT_HEADER = "Invoice Information: "
+
+QA_MODEL = "distilbert-base-cased-distilled-squad"
+
+
+class SimpleLLMChatbot(InvoiceAnswers):
+    def __init__(self, warm_up=False, qa_batch_size=16, context_size=8, cache_size=256, cache_ttl=300,
+                 invoices=None, inference=None, qa_model_name=QA_MODEL):
+        self.parser = make_parser(invoices)
+        self.inference = inference or InferenceOptions.from_env()
         self.running = True
-        self.qa_pipeline = None
-        self.load_qa_model()
+        self.last_listing = None
+        self.response_cache = ResponseCache(cache_size, cache_ttl)
+        self.qa_batch_size = qa_batch_size
+        self.context_size = context_size
+        self.retriever = retriever_for(self.parser.invoices)
+        self._context = None
+        self._sentences = {}
+        self._sentence_encodings = {}
+        self._context_version = None
+        # Bots with the same model and options share one loaded copy
+        self.qa_model_name = qa_model_name
+        self.qa_model_key = ('question-answering', qa_model_name, self.inference.key())
+        self.qa_model = models.acquire(self.qa_model_key, self.load_qa_model)
+        self._released = False
+        if warm_up:
+            self.qa_model.warm_up()
+    
+    @property
+    def qa_pipeline(self):
+        """The Q&A pipeline, loaded on first access."""
+        return self.qa_model.get()
     
     def load_qa_model(self):
         """Load a lightweight Q&A model."""
         try:
+            # Deferred so rule-based queries never pay for the import
+            from transformers import pipeline
+            
             print("Loading lightweight Q&A model...")
             # Use DistilBERT for question answering - much smaller and faster
-            self.qa_pipeline = pipeline(
+            qa_pipeline = pipeline(
                 "question-answering",
-                model="distilbert-base-cased-distilled-squad",
-                tokenizer="distilbert-base-cased-distilled-squad"
+                model=self.qa_model_name,
+                tokenizer=self.qa_model_name
             )
+            qa_pipeline.model = optimize_model(qa_pipeline.model, self.inference, self.probe_inputs(qa_pipeline.tokenizer))
             print("✅ Q&A model loaded successfully!")
+            return qa_pipeline
         except Exception as e:
             print(f"⚠️ Could not load Q&A model: {e}")
-            self.qa_pipeline = None
+            return None
+    
+    def close(self):
+        """Release this bot's hold on the shared Q&A model and stop any parser workers."""
+        if not self._released:
+            self._released = True
+            models.release(self.qa_model_key)
+            self.parser.close()
+    
+    def probe_inputs(self, tokenizer):
+        """Encode a few questions over the invoice data for checking an optimized model."""
+        questions = ["Which vendor has the largest invoice?", "When is the next invoice due?",
+                     "What is the invoice number?"]
+        context = self.create_invoice_context(" ".join(questions))
+        return tokenizer(questions, [context] * len(questions), padding=True, truncation='only_second',
+                         max_length=384, return_tensors='pt')
+    
+    def sync_context_cache(self):
+        """Drop cached context text and encodings if the invoices changed."""
+        version = self.parser.invoices.version
+        if self._context_version != version:
+            self._context = None
+            self._sentences = {}
+            self._sentence_encodings = {}
+            self._context_version = version
+    
+    def invoice_sentence(self, row):
+        """Describe one invoice for the context, cached per data version."""
+        sentence = self._sentences.get(row)
+        if sentence is None:
+            inv = self.parser.invoices[row]
+            sentence = self._sentences[row] = (
+                f"Vendor {inv['vendor']} has invoice number {inv['invoice_number']} "
+                f"dated {inv['invoice_date']} with due date {inv['due_date']} "
+                f"for total amount ${inv['total']:.2f}. "
+            )
+        return sentence
+    
+    def context_rows(self, query):
+        """Pick the invoices to include in the context for a query."""
+        return self.retriever.search(query, self.context_size)
     
-    def create_invoice_context(self):
-        """Create a text context from invoice data."""
-        context = "Invoice Information: "
-        for inv in self.parser.invoices:
-            context += f"Vendor {inv['vendor']} has invoice number {inv['invoice_number']} "
-            context += f"dated {inv['invoice_date']} with due date {inv['due_date']} "
-            context += f"for total amount ${inv['total']:.2f}. "
-        return context
+    @timed('context')
+    def create_invoice_context(self, query=None):
+        """Create a text context from the invoices relevant to a query, or from all of them."""
+        self.sync_context_cache()
+        if query is not None:
+            rows = self.context_rows(query)
+            return CONTEXT_HEADER + "".join(self.invoice_sentence(row) for row in rows)
+        
+        if self._context is None:
+            rows = self.parser.invoices.live_rows()
+            self._context = CONTEXT_HEADER + "".join(self.invoice_sentence(row) for row in rows)
+        return self._context
+    
+    @timed('context')
+    def get_context_encoding(self, query):
+        """Get the context for a query and its tokenization, built from cached pieces."""
+        self.sync_context_cache()
+        tokenizer = self.qa_pipeline.tokenizer
+        rows = self.context_rows(query)
+        
+        # Each piece ends in whitespace, so encoding them separately and
+        # shifting the offsets gives the same tokens as the joined text.
+        pieces = [('header', CONTEXT_HEADER)]
+        pieces.extend((row, self.invoice_sentence(row)) for row in rows)
+        input_ids, offsets, position = [], [], 0
+        for key, text in pieces:
+            encoding = self._sentence_encodings.get(key)
+            if encoding is None:
+                encoding = self._sentence_encodings[key] = encode_context(tokenizer, text)
+            input_ids.extend(encoding['input_ids'])
+            offsets.extend((start + position, end + position) for start, end in encoding['offset_mapping'])
+            position += len(text)
+        
+        context = "".join(text for _, text in pieces)
+        return context, {'input_ids': input_ids, 'offset_mapping': offsets}
     
     def process_query(self, query):
         """Process user query with rule-based + LLM fallback."""
-        query_lower = query.lower()
+        intent, slots = route(query)
         
         # Check for exit commands
-        if any(word in query_lower for word in ['quit', 'exit', 'bye']):
+        if intent == 'exit':
             self.running = False
             return "Goodbye! Thanks for using the Invoice Chatbot."
+        if intent in PAGED:
+            return self.answer_query(query, intent, slots)
         
+        # Serve repeated questions from the cache while the data is unchanged
+        version = self.parser.invoices.version
+        response = self.response_cache.get(query, version)
+        if response is None:
+            response = self.answer_query(query, intent, slots)
+            self.response_cache.put(query, version, response)
+        return response
+    
+    def stream_query(self, query):
+        """Process a query, yielding listings line by line as they are rendered."""
+        intent, slots = route(query)
+        if intent in PAGED:
+            yield from iter_lines(dispatch(self, intent, slots, stream=True))
+        else:
+            yield self.process_query(query)
+    
+    def answer_query(self, query, intent, slots):
+        """Answer a routed query with rule-based processing, falling back to the Q&A model."""
         # Try rule-based processing first (faster)
-        rule_response = self.try_rule_based(query)
+        rule_response = dispatch(self, intent, slots)
         if rule_response:
             return rule_response
         
         # Fallback to Q&A model
         if self.qa_pipeline:
+            count('resolved.model')
             return self.try_qa_model(query)
         
-        return self.show_help()
+        count('resolved.help')
+        return TransientResponse(self.show_help())
     
     def try_rule_based(self, query):
         """Try rule-based processing first."""
-        query_lower = query.lower()
-        
-        # Show all invoices
-        if 'show' in query_lower and 'all' in query_lower:
-            return self.show_all_invoices()
-        
-        # Due in next X days
-        if 'due' in query_lower and ('next' in query_lower or 'days' in query_lower):
-            days_match = re.search(r'(\d+)\s*days?', query_lower)
-            days = int(days_match.group(1)) if days_match else 7
-            return self.handle_due_invoices(days)
+        intent, slots = route(query)
+        return dispatch(self, intent, slots)
+    
+    def process_queries(self, queries, batch_size=None):
+        """Process many queries in order, batching the ones that need the Q&A model."""
+        # Rule-based answers are filled in first; only the leftovers are
+        # sent to the model, and an error on one query never fails the rest.
+        queries = list(queries)
+        responses = [None] * len(queries)
+        version = self.parser.invoices.version
+        pending = []
         
-        # Total value from specific vendor
-        if 'total' in query_lower and 'from' in query_lower:
-            vendor_match = re.search(r'from\s+(\w+)', query_lower)
-            if vendor_match:
-                vendor = vendor_match.group(1)
-                return self.handle_vendor_total(vendor)
+        for i, query in enumerate(queries):
+            try:
+                intent, slots = route(query)
+                if intent == 'exit':
+                    responses[i] = "Goodbye! Thanks for using the Invoice Chatbot."
+                    continue
+                if intent in PAGED:
+                    responses[i] = dispatch(self, intent, slots)
+                    continue
+                responses[i] = self.response_cache.get(query, version)
+                if responses[i] is None:
+                    responses[i] = dispatch(self, intent, slots)
+                    if responses[i] is not None:
+                        self.response_cache.put(query, version, responses[i])
+            except Exception as e:
+                responses[i] = f"Error processing query: {e}"
+            if responses[i] is None:
+                pending.append(i)
         
-        # List vendors above amount
-        if 'list' in query_lower and 'vendors' in query_lower and ('>' in query or 'above' in query_lower):
-            amount_match = re.search(r'(?:>|above)\s*\$?(\d+(?:,\d{3})*)', query)
-            if amount_match:
-                amount = float(amount_match.group(1).replace(',', ''))
-                return self.handle_vendors_above_amount(amount)
+        batch_size = batch_size or self.qa_batch_size
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            answers = self.answer_model_batch([queries[i] for i in batch], batch_size)
+            for i, answer in zip(batch, answers):
+                responses[i] = answer
+                self.response_cache.put(queries[i], version, answer)
         
-        return None  # No rule-based match
+        return responses
+    
+    def answer_model_batch(self, queries, batch_size=None):
+        """Answer queries that need the Q&A model, in order."""
+        if not self.qa_pipeline:
+            count('resolved.help', len(queries))
+            return [TransientResponse(self.show_help()) for _ in queries]
+        count('resolved.model', len(queries))
+        return self.try_qa_model_batch(queries, batch_size)
     
     def try_qa_model(self, query):
         """Try Q&A model for natural language queries."""
         try:
-            context = self.create_invoice_context()
-            result = self.qa_pipeline(question=query, context=context)
-            
-            # If confidence is reasonable, return the answer
-            if result['score'] > 0.1:
-                return f"{result['answer']} (confidence: {result['score']:.2f})"
-            else:
-                return "I'm not confident about that answer. Try asking more specifically about vendors, dates, or amounts."
+            context, encoding = self.get_context_encoding(query)
+            result = answer_questions(self.qa_pipeline, [query], [context], [encoding])[0]
+            return self.format_qa_result(result)
                 
         except Exception as e:
-            return f"Error processing with AI model: {e}"
+            return TransientResponse(f"Error processing with AI model: {e}")
     
-    def handle_due_invoices(self, days=7):
-        """Handle queries about invoices due in X days."""
-        due_invoices = self.parser.get_invoices_due_in_days(days)
-        
-        if not due_invoices:
-            return f"No invoices are due in the next {days} days."
-        
-        count = len(due_invoices)
-        response = f"{count} invoice{'s' if count != 1 else ''} due in the next {days} days:\n"
-        
-        for inv in due_invoices:
-            response += f"- {inv['vendor']}, due {self.parser.format_date(inv['due_date'])}, {self.parser.format_currency(inv['total'])}\n"
-        
-        return response.strip()
-    
-    def handle_vendor_total(self, vendor):
-        """Handle queries about total from specific vendor."""
-        invoice = self.parser.get_invoice_by_vendor(vendor)
-        
-        if not invoice:
-            return f"No invoice found from {vendor}."
-        
-        return f"Total value of invoice from {invoice['vendor']}: {self.parser.format_currency(invoice['total'])}"
-    
-    def handle_vendors_above_amount(self, amount):
-        """Handle queries about vendors with invoices above amount."""
-        invoices = self.parser.get_invoices_above_amount(amount)
-        
-        if not invoices:
-            return f"No vendors have invoices above {self.parser.format_currency(amount)}."
-        
-        response = f"Vendors with invoices > {self.parser.format_currency(amount)}:\n"
-        for inv in invoices:
-            response += f"- {inv['vendor']} ({self.parser.format_currency(inv['total'])})\n"
+    def try_qa_model_batch(self, queries, batch_size=None):
+        """Run the Q&A model over a batch of queries in one forward pass."""
+        try:
+            contexts, encodings = zip(*(self.get_context_encoding(query) for query in queries))
+            results = answer_questions(
+                self.qa_pipeline, queries, contexts, encodings,
+                batch_size=batch_size or self.qa_batch_size
+            )
+            return [self.format_qa_result(result) for result in results]
         
-        return response.strip()
+        except Exception:
+            # Isolate the failure by answering each query on its own
+            return [self.try_qa_model(query) for query in queries]
     
-    def show_all_invoices(self):
-        """Show all invoices."""
-        response = "All invoices:\n"
-        for inv in self.parser.invoices:
-            response += f"- {inv['vendor']}: {inv['invoice_number']}, due {self.parser.format_date(inv['due_date'])}, {self.parser.format_currency(inv['total'])}\n"
-        return response.strip()
+    def format_qa_result(self, result):
+        """Turn a Q&A pipeline result into a response."""
+        # If confidence is reasonable, return the answer
+        if result['score'] > 0.1:
+            return f"{result['answer']} (confidence: {result['score']:.2f})"
+        else:
+            return "I'm not confident about that answer. Try asking more specifically about vendors, dates, or amounts."
     
     def show_help(self):
         """Show help message."""
@@ -156,9 +277,14 @@ class SimpleLLMChatbot:
 • "What is the total value of the invoice from Amazon?"
 • "List all vendors with invoices above $2,000"
 • "Show me all invoices"
+• "What invoices are overdue?"
 • "Which vendor has the highest invoice?"
+• "Who owes the most money?"
+• "How many unpaid invoices are there?"
 • "What is Amazon's invoice number?"
 
+Long lists are shown a page at a time; say "more" for the next page.
+
 Type 'quit', 'exit', or 'bye' to exit."""
     
     def run(self):
@@ -166,10 +292,12 @@ Type 'quit', 'exit', or 'bye' to exit."""
         print("🤖 Invoice Chatbot (with Local AI)")
         print("=" * 50)
         
-        if self.qa_pipeline:
+        if self.qa_model.is_loaded():
             print("✅ Local Q&A model loaded - I can understand natural language!")
+        elif self.qa_model.is_loading():
+            print("⏳ Local Q&A model loading in the background - rule-based queries work right away")
         else:
-            print("⚠️ Local AI model not available - using rule-based responses only")
+            print("💤 Local Q&A model will load on the first natural language query")
         
         print("Ask me about your invoices! Type 'help' for examples.\n")
         
@@ -179,16 +307,23 @@ Type 'quit', 'exit', or 'bye' to exit."""
                 if not query:
                     continue
                 
-                response = self.process_query(query)
-                print(f"Bot: {response}\n")
+                print("Bot: ", end="", flush=True)
+                for piece in self.stream_query(query):
+                    print(piece, end="", flush=True)
+                print("\n")
                 
             except KeyboardInterrupt:
                 print("\n\nGoodbye! Thanks for using the Invoice Chatbot.")
                 break
             except Exception as e:
                 print(f"Bot: Sorry, I encountered an error: {e}\n")
+        
+        registry.flush()
 
 
 if __name__ == "__main__":
-    chatbot = SimpleLLMChatbot()
-    chatbot.run()
\ No newline at end of file
+    chatbot = SimpleLLMChatbot(warm_up=True)
+    try:
+        chatbot.run()
+    finally:
+        chatbot.close()
\ No newline at end of file
@@ -0,0 +1,171 @@
+"""
+CPU inference options for the Q&A and generation models.
+
+Models can be dynamically quantized to int8, run with explicit torch
+thread counts, and compiled with TorchScript or torch.compile. Any
+optimized model is checked against the fp32 model it came from on a few
+probe inputs, and the fp32 model is kept if their predictions disagree.
+"""
+
+import copy
+import os
+from types import SimpleNamespace
+
+
+QUANTIZE_MODES = (None, 'int8')
+COMPILE_MODES = (None, 'torchscript', 'compile')
+
+
+class InferenceOptions:
+    def __init__(self, quantize=None, threads=None, interop_threads=None, compile=None,
+                 verify=True, min_agreement=0.9):
+        """Initialize CPU inference options; the defaults leave models as loaded."""
+        if quantize not in QUANTIZE_MODES:
+            raise ValueError(f"quantize must be one of {QUANTIZE_MODES}, not {quantize!r}")
+        if compile not in COMPILE_MODES:
+            raise ValueError(f"compile must be one of {COMPILE_MODES}, not {compile!r}")
+        self.quantize = quantize
+        self.threads = threads
+        self.interop_threads = interop_threads
+        self.compile = compile
+        self.verify = verify
+        self.min_agreement = min_agreement
+    
+    @classmethod
+    def from_env(cls):
+        """Read options from the INVOICE_QUANTIZE, INVOICE_TORCH_* and INVOICE_VERIFY_OPTIMIZED variables."""
+        def number(name):
+            value = os.environ.get(name)
+            return int(value) if value else None
+        
+        return cls(
+            quantize=os.environ.get('INVOICE_QUANTIZE') or None,
+            threads=number('INVOICE_TORCH_THREADS'),
+            interop_threads=number('INVOICE_TORCH_INTEROP_THREADS'),
+            compile=os.environ.get('INVOICE_TORCH_COMPILE') or None,
+            verify=os.environ.get('INVOICE_VERIFY_OPTIMIZED', '1') != '0'
+        )
+    
+    def key(self):
+        """Hashable identity of these options, for sharing models loaded with them."""
+        return (self.quantize, self.threads, self.interop_threads, self.compile, self.verify, self.min_agreement)
+    
+    @property
+    def optimized(self):
+        """Whether these options change the model itself."""
+        return self.quantize is not None or self.compile is not None
+    
+    def describe(self):
+        """Short human-readable summary of the options."""
+        parts = [self.quantize or 'fp32']
+        if self.compile:
+            parts.append(self.compile)
+        if self.threads:
+            parts.append(f"{self.threads} threads")
+        return ", ".join(parts)
+
+
+def configure_threads(options):
+    """Apply the torch intra-op and inter-op thread counts."""
+    import torch
+    
+    if options.threads:
+        torch.set_num_threads(options.threads)
+    if options.interop_threads:
+        try:
+            torch.set_num_interop_threads(options.interop_threads)
+        except RuntimeError:
+            # Can only be set once, before any inter-op parallel work
+            pass
+
+
+def quantize_model(model):
+    """Quantize a model's linear layers to int8 with dynamic activation scales."""
+    import torch
+    from torch.ao.quantization import quantize_dynamic
+    
+    return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class TracedModel:
+    def __init__(self, traced, config, device):
+        """Wrap a TorchScript module so it is called like the Hugging Face model."""
+        self.traced = traced
+        self.config = config
+        self.device = device
+    
+    def __call__(self, input_ids, attention_mask):
+        return SimpleNamespace(**self.traced(input_ids, attention_mask))
+
+
+def compile_model(model, method, example):
+    """Compile a model with TorchScript or torch.compile, leaving the original untouched."""
+    import torch
+    
+    if method == 'torchscript':
+        traced = torch.jit.trace(model, (example['input_ids'], example['attention_mask']), strict=False)
+        return TracedModel(torch.jit.freeze(traced.eval()), model.config, model.device)
+    # A shallow copy shares the weights but gets its own compiled forward,
+    # which generate() and direct calls both go through.
+    compiled = copy.copy(model)
+    compiled.forward = torch.compile(model.forward, dynamic=True)
+    return compiled
+
+
+def predictions(model, example):
+    """Argmax predictions of a model on example inputs, ignoring padding."""
+    import torch
+    
+    with torch.inference_mode():
+        output = model(input_ids=example['input_ids'], attention_mask=example['attention_mask'])
+    mask = example['attention_mask'].bool()
+    result = []
+    for name in ('logits', 'start_logits', 'end_logits'):
+        logits = getattr(output, name, None)
+        if logits is None:
+            continue
+        if logits.dim() == 2:
+            # Q&A logits: one position picked per sequence
+            result.append(logits.masked_fill(~mask, float('-inf')).argmax(-1))
+        else:
+            # Language model logits: one token predicted per position
+            result.append(logits.argmax(-1)[mask])
+    return result
+
+
+def agreement(expected, actual):
+    """Fraction of predictions that match between two predictions() results."""
+    total = sum(a.numel() for a in expected)
+    if not total or len(expected) != len(actual):
+        return 0.0
+    return sum(int((a == b).sum()) for a, b in zip(expected, actual)) / total
+
+
+def optimize_model(model, options, example=None, supports_torchscript=True):
+    """Apply the options to a loaded model, keeping fp32 if the result is inaccurate."""
+    configure_threads(options)
+    model.eval()
+    if not options.optimized:
+        return model
+    
+    try:
+        verify = options.verify and example is not None
+        expected = predictions(model, example) if verify else None
+        candidate = quantize_model(model) if options.quantize == 'int8' else model
+        if options.compile == 'torchscript' and not supports_torchscript:
+            print("⚠️ TorchScript is not supported for this model; skipping compilation.")
+        elif options.compile and example is not None:
+            candidate = compile_model(candidate, options.compile, example)
+        elif options.compile:
+            print("⚠️ No example inputs to compile with; skipping compilation.")
+        score = agreement(expected, predictions(candidate, example)) if verify else None
+    except Exception as e:
+        print(f"⚠️ Could not optimize model ({options.describe()}): {e}")
+        return model
+    
+    if score is not None:
+        if score < options.min_agreement:
+            print(f"⚠️ Optimized model agrees with fp32 on only {score:.0%} of predictions; using fp32.")
+            return model
+        print(f"✅ Optimized model ({options.describe()}) agrees with fp32 on {score:.0%} of predictions")
+    return candidate
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""
+Rule-based intent routing shared by the chatbots.
+
+Every keyword and slot pattern is compiled into one regular expression,
+so a question is routed with a single scan of its text no matter how
+many intents there are.
+"""
+
+import re
+from invoice_listing import Listing
+from metrics import count, timed, timer
+
+
+TOKEN_PATTERNS = [
+    ('exit', r"\b(?:quit|exit|bye|goodbye)\b"),
+    # Only at the start, so it does not claim questions that merely contain "more"
+    ('more', r"^\s*(?:show\s+(?:me\s+)?)?(?:more|next\s+page)\b"),
+    ('show', r"\bshow\b"),
+    ('all', r"\ball\b"),
+    ('due', r"\bdue\b"),
+    ('next', r"\bnext\b"),
+    ('days', r"(?:\b(?P<days_n>\d+)\s*)?\bdays?\b"),
+    ('total', r"\btotal\b"),
+    # A lookahead, so the words after "from" are still scanned for tokens
+    ('from', r"\bfrom\s+(?=(?P<vendor_s>[^?!,;]+))"),
+    ('list', r"\blist\b"),
+    ('vendors', r"\bvendors\b"),
+    ('amount', r"(?:>|\babove\b|\bover\b)\s*\$?\s*(?P<amount_n>\d+(?:,\d{3})*(?:\.\d+)?)"),
+    ('overdue', r"\boverdue\b"),
+    # Superlatives, optionally preceded by how many results are wanted
+    ('top', r"\btop\s+(?P<top_n>\d+)\b"),
+    ('latest', r"(?:\b(?P<latest_n>\d+)\s+)?\b(?:latest|newest|most\s+recent)\b"),
+    ('earliest', r"(?:\b(?P<earliest_n>\d+)\s+)?\b(?:earliest|soonest|oldest)\b"),
+    ('most', r"(?:\b(?P<most_n>\d+)\s+)?\b(?:highest|largest|biggest|greatest|most|max|top)\b"),
+    ('least', r"(?:\b(?P<least_n>\d+)\s+)?\b(?:lowest|smallest|least|min|cheapest)\b"),
+    ('owe', r"\b(?:owes?|owed|owing|outstanding|unpaid|open)\b"),
+    ('party', r"\b(?:vendor|company|companies|supplier|suppliers|who)\b"),
+    ('count', r"\bhow\s+many\b|\bcount\b|\bnumber\s+of\b"),
+    ('sum', r"\bhow\s+much\b|\bsum\b|\bcombined\b|\baltogether\b|\bin\s+total\b"),
+]
+
+RANKS = frozenset({'top', 'most', 'least'})
+DATE_RANKS = frozenset({'earliest', 'latest'})
+
+TOKEN_RE = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in TOKEN_PATTERNS))
+
+# (intent, tokens that must all appear, tokens of which at least one must
+# appear). Rules are tried in order, so earlier intents win.
+RULES = [
+    ('exit', frozenset({'exit'}), frozenset()),
+    ('more', frozenset({'more'}), frozenset()),
+    ('show_all', frozenset({'show', 'all'}), frozenset()),
+    ('due_in_days', frozenset({'due'}), frozenset({'next', 'days'})),
+    ('vendor_rank', frozenset({'owe'}), RANKS),
+    ('vendor_rank', frozenset({'total', 'party'}), RANKS),
+    ('vendor_rank', frozenset({'total', 'vendors'}), RANKS),
+    ('invoice_rank', frozenset(), DATE_RANKS),
+    ('invoice_rank', frozenset(), RANKS),
+    ('vendor_total', frozenset({'total', 'from'}), frozenset()),
+    ('vendors_above_amount', frozenset({'list', 'vendors', 'amount'}), frozenset()),
+    ('overdue', frozenset({'overdue'}), frozenset()),
+    ('invoice_count', frozenset({'count'}), frozenset()),
+    ('amount_sum', frozenset({'sum'}), frozenset()),
+    ('amount_sum', frozenset({'total', 'all'}), frozenset()),
+]
+
+# Intent -> name of the chatbot method that answers it. Slots are passed
+# to the method as keyword arguments.
+HANDLERS = {
+    'show_all': 'show_all_invoices',
+    'due_in_days': 'handle_due_invoices',
+    'vendor_total': 'handle_vendor_total',
+    'vendors_above_amount': 'handle_vendors_above_amount',
+    'overdue': 'handle_overdue_invoices',
+    'vendor_rank': 'handle_vendor_rank',
+    'invoice_rank': 'handle_invoice_rank',
+    'invoice_count': 'handle_invoice_count',
+    'amount_sum': 'handle_amount_sum',
+    'more': 'show_more',
+}
+
+# Intents answered with a paginated Listing, and the intent that continues
+# the last one. Their answers depend on the page asked for and on what was
+# listed before, so the answers are never cached; the listing handlers
+# cache the rows they page through instead.
+LISTINGS = frozenset({'show_all', 'due_in_days', 'overdue', 'vendors_above_amount'})
+PAGED = LISTINGS | {'more'}
+
+
+@timed('route')
+def route(query):
+    """Return (intent, slots) for a question; intent is None if no rule matches."""
+    found = set()
+    slots = {}
+    for match in TOKEN_RE.finditer(query.casefold()):
+        token = match.lastgroup
+        found.add(token)
+        if token == 'days' and match.group('days_n') and 'days' not in slots:
+            slots['days'] = int(match.group('days_n'))
+        elif token == 'from' and 'vendor' not in slots:
+            slots['vendor'] = match.group('vendor_s').strip().rstrip('.')
+        elif token == 'amount' and 'amount' not in slots:
+            slots['amount'] = float(match.group('amount_n').replace(',', ''))
+        elif token in RANKS | DATE_RANKS and match.group(f'{token}_n') and 'n' not in slots:
+            slots['n'] = int(match.group(f'{token}_n'))
+    
+    for intent, required, any_of in RULES:
+        if required <= found and (not any_of or any_of & found):
+            if intent == 'due_in_days':
+                return intent, {'days': slots.get('days', 7)}
+            if intent == 'vendor_total':
+                return intent, {'vendor': slots['vendor']}
+            if intent == 'vendors_above_amount':
+                return intent, {'amount': slots['amount']}
+            if intent == 'vendor_rank':
+                return intent, {
+                    'by': 'open_balance' if 'owe' in found else 'total',
+                    'n': slots.get('n', 1),
+                    'largest': 'least' not in found
+                }
+            if intent == 'invoice_rank':
+                if DATE_RANKS & found:
+                    field = 'due_date' if 'due' in found else 'invoice_date'
+                    largest = 'latest' in found
+                else:
+                    field, largest = 'total', 'least' not in found
+                return intent, {'field': field, 'n': slots.get('n', 1), 'largest': largest, 'vendor': slots.get('vendor')}
+            if intent in ('invoice_count', 'amount_sum'):
+                return intent, {'vendor': slots.get('vendor'), 'open_only': 'owe' in found}
+            return intent, {}
+    return None, {}
+
+
+def dispatch(bot, intent, slots, stream=False):
+    """Call the bot's handler for an intent, or return None if it has none.
+    
+    A Listing is rendered to a string unless stream is set, in which case
+    it is returned for the caller to print line by line.
+    """
+    method = HANDLERS.get(intent)
+    if method is None:
+        return None
+    with timer('handler'):
+        response = getattr(bot, method)(**slots)
+        if not stream and isinstance(response, Listing):
+            response = str(response)
+    count('resolved.rule')
+    return response
\ No newline at end of file
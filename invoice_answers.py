@@ -0,0 +1,196 @@
+"""
+Rule-based answers shared by the invoice chatbots.
+
+InvoiceAnswers is mixed into both bots and words the answers to listing,
+total, ranking, counting and summing questions from the bot's parser.
+Listings are paged, and the last one is kept in last_listing so "more"
+can continue it. The rows a listing pages through are cached with the
+bot's responses, so every page of a repeated listing reuses them.
+"""
+
+from functools import partial
+from invoice_listing import PAGE_SIZE, Listing
+
+
+class InvoiceAnswers:
+    def listed_rows(self, method, *args):
+        """Rows from a parser query, cached per arguments while the invoices are unchanged."""
+        key = (method, *args)
+        version = self.parser.invoices.version
+        rows = self.response_cache.get(key, version)
+        if rows is None:
+            rows = getattr(self.parser, method)(*args)
+            self.response_cache.put(key, version, rows)
+        return rows
+    
+    def listing(self, header, rows, render, keys, limit, offset, cursor, more):
+        """Page through rows, remembering the listing so 'more' can continue it."""
+        self.last_listing = Listing(header, rows, render, keys, limit, offset, cursor, more)
+        return self.last_listing
+    
+    def due_line(self, row):
+        """Render an invoice as a listing line with its due date."""
+        inv = self.parser.invoices[row]
+        return f"- {inv['vendor']}, due {self.parser.format_date(inv['due_date'])}, {self.parser.format_currency(inv['total'])}"
+    
+    def handle_due_invoices(self, days=7, limit=PAGE_SIZE, offset=0, cursor=None):
+        """Handle queries about invoices due in X days."""
+        rows = self.listed_rows('get_due_rows_in_days', days)
+        
+        if not len(rows):
+            return f"No invoices are due in the next {days} days."
+        
+        header = f"{len(rows)} invoice{'s' if len(rows) != 1 else ''} due in the next {days} days:"
+        return self.listing(header, rows, self.due_line, self.parser.invoices.due_date, limit, offset, cursor,
+                            partial(self.handle_due_invoices, days, limit))
+    
+    def handle_vendor_total(self, vendor):
+        """Handle queries about total from specific vendor."""
+        vendor = self.parser.find_vendor(vendor)
+        summary = self.parser.get_vendor_summary(vendor)
+        
+        if not summary:
+            return f"No invoice found from {vendor}."
+        
+        if summary['count'] == 1:
+            return f"Total value of invoice from {summary['vendor']}: {self.parser.format_currency(summary['total'])}"
+        
+        response = f"Total value of {summary['count']} invoices from {summary['vendor']}: {self.parser.format_currency(summary['total'])}"
+        if summary['open_balance'] != summary['total']:
+            response += f" ({self.parser.format_currency(summary['open_balance'])} still open)"
+        return response
+    
+    def amount_line(self, row):
+        """Render an invoice as a listing line with its vendor and total."""
+        inv = self.parser.invoices[row]
+        return f"- {inv['vendor']} ({self.parser.format_currency(inv['total'])})"
+    
+    def handle_vendors_above_amount(self, amount, limit=PAGE_SIZE, offset=0, cursor=None):
+        """Handle queries about vendors with invoices above amount."""
+        rows = self.listed_rows('get_rows_above_amount', amount)
+        
+        if not len(rows):
+            return f"No vendors have invoices above {self.parser.format_currency(amount)}."
+        
+        header = f"Vendors with invoices > {self.parser.format_currency(amount)}:"
+        return self.listing(header, rows, self.amount_line, None, limit, offset, cursor,
+                            partial(self.handle_vendors_above_amount, amount, limit))
+    
+    def handle_overdue_invoices(self, limit=PAGE_SIZE, offset=0, cursor=None):
+        """Handle queries about overdue invoices."""
+        rows = self.listed_rows('get_overdue_rows')
+        
+        if not len(rows):
+            return "No invoices are overdue."
+        
+        header = f"{len(rows)} overdue invoice{'s' if len(rows) != 1 else ''}:"
+        return self.listing(header, rows, self.due_line, self.parser.invoices.due_date, limit, offset, cursor,
+                            partial(self.handle_overdue_invoices, limit))
+    
+    def handle_invoice_rank(self, field='total', n=1, largest=True, vendor=None):
+        """Handle queries about the highest, lowest, earliest or latest invoices."""
+        if vendor is not None:
+            vendor = self.parser.find_vendor(vendor)
+            if not self.parser.get_vendor_summary(vendor):
+                return f"No invoice found from {vendor}."
+        
+        invoices = self.parser.get_ranked_invoices(field, n, largest, vendor)
+        if not invoices:
+            return "No invoices found."
+        
+        rank, noun, order = {
+            ('total', True): ('highest', 'invoice', 'amount'),
+            ('total', False): ('lowest', 'invoice', 'amount'),
+            ('due_date', True): ('latest', 'due date', 'due date'),
+            ('due_date', False): ('earliest', 'due date', 'due date'),
+            ('invoice_date', True): ('most recent', 'invoice', 'invoice date'),
+            ('invoice_date', False): ('oldest', 'invoice', 'invoice date')
+        }[field, largest]
+        
+        if len(invoices) == 1:
+            inv = invoices[0]
+            details = f"{inv['invoice_number']}, {self.parser.format_currency(inv['total'])}, due {self.parser.format_date(inv['due_date'])}"
+            if vendor is not None:
+                return f"The {rank} {noun} from {inv['vendor']}: {details}"
+            return f"{inv['vendor']} has the {rank} {noun}: {details}"
+        
+        response = f"{rank.capitalize()} {len(invoices)} invoices by {order}"
+        response += f" from {invoices[0]['vendor']}:\n" if vendor is not None else ":\n"
+        for inv in invoices:
+            response += f"- {inv['vendor']}: {inv['invoice_number']}, due {self.parser.format_date(inv['due_date'])}, {self.parser.format_currency(inv['total'])}\n"
+        
+        return response.strip()
+    
+    def handle_vendor_rank(self, by='total', n=1, largest=True):
+        """Handle queries about the vendors with the largest or smallest totals or open balances."""
+        vendors = self.parser.get_ranked_vendors(by, n, largest)
+        if not vendors:
+            return "No invoices found."
+        
+        rank = 'largest' if largest else 'smallest'
+        measure = 'open balance' if by == 'open_balance' else 'invoice total'
+        invoices = 'open_count' if by == 'open_balance' else 'count'
+        
+        if len(vendors) == 1:
+            stats = vendors[0]
+            return f"{stats['vendor']} has the {rank} {measure}: {self.parser.format_currency(stats[by])} ({stats[invoices]} invoice{'s' if stats[invoices] != 1 else ''})"
+        
+        response = f"Vendors with the {rank} {measure}:\n"
+        for stats in vendors:
+            response += f"- {stats['vendor']}: {self.parser.format_currency(stats[by])} ({stats[invoices]} invoice{'s' if stats[invoices] != 1 else ''})\n"
+        
+        return response.strip()
+    
+    def find_summary(self, vendor=None):
+        """Resolve vendor and return (vendor, its summary, " from <vendor>"), or the ledger's if vendor is None."""
+        if vendor is None:
+            return None, self.parser.get_ledger_summary(), ""
+        vendor = self.parser.find_vendor(vendor)
+        summary = self.parser.get_vendor_summary(vendor)
+        return vendor, summary, f" from {summary['vendor']}" if summary else ""
+    
+    def handle_invoice_count(self, vendor=None, open_only=False):
+        """Handle queries about how many invoices there are."""
+        vendor, summary, source = self.find_summary(vendor)
+        if not summary:
+            return f"No invoice found from {vendor}."
+        
+        if open_only:
+            n = summary['open_count']
+            return f"{n} open invoice{'s' if n != 1 else ''}{source}, totaling {self.parser.format_currency(summary['open_balance'])}."
+        
+        response = f"{summary['count']} invoice{'s' if summary['count'] != 1 else ''}{source}"
+        if summary['open_count'] != summary['count']:
+            response += f" ({summary['open_count']} still open)"
+        return response + "."
+    
+    def handle_amount_sum(self, vendor=None, open_only=False):
+        """Handle queries about the combined value of invoices."""
+        vendor, summary, source = self.find_summary(vendor)
+        if not summary:
+            return f"No invoice found from {vendor}."
+        
+        if open_only:
+            n = summary['open_count']
+            return f"Open balance{source}: {self.parser.format_currency(summary['open_balance'])} across {n} invoice{'s' if n != 1 else ''}"
+        
+        response = f"Total value of {summary['count']} invoice{'s' if summary['count'] != 1 else ''}{source}: {self.parser.format_currency(summary['total'])}"
+        if summary['open_balance'] != summary['total']:
+            response += f" ({self.parser.format_currency(summary['open_balance'])} still open)"
+        return response
+    
+    def invoice_line(self, row):
+        """Render an invoice as a listing line with its number and due date."""
+        inv = self.parser.invoices[row]
+        return f"- {inv['vendor']}: {inv['invoice_number']}, due {self.parser.format_date(inv['due_date'])}, {self.parser.format_currency(inv['total'])}"
+    
+    def show_all_invoices(self, limit=PAGE_SIZE, offset=0, cursor=None):
+        """Show all invoices."""
+        rows = self.listed_rows('get_live_rows')
+        return self.listing(f"All invoices ({len(rows)}):", rows, self.invoice_line, None, limit, offset, cursor,
+                            partial(self.show_all_invoices, limit))
+    
+    def show_more(self):
+        """Show the next page of the last listing."""
+        page = self.last_listing.next_page() if self.last_listing else None
+        return page or "There is nothing more to show."
\ No newline at end of file
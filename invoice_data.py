@@ -3,7 +3,9 @@ Sample invoice data for the chatbot.
 In a real implementation, this would be extracted from PDF/image files.
 """
 
+import os
 from datetime import datetime
+from invoice_store import InvoiceStore
 
 # Sample invoice data extracted from invoices
 SAMPLE_INVOICES = [
@@ -30,6 +32,37 @@ SAMPLE_INVOICES = [
     }
 ]
 
+_store = None
+
+
+def load_source():
+    """Build a store from INVOICE_DATA_FILE, or from the sample invoices if it is unset."""
+    path = os.environ.get('INVOICE_DATA_FILE')
+    if not path:
+        return InvoiceStore(SAMPLE_INVOICES)
+    from invoice_loader import InvoiceFileLoader
+    store = InvoiceStore()
+    for chunk in InvoiceFileLoader(path).read_chunks():
+        store.extend(chunk)
+    return store
+
+
 def get_invoices():
-    """Return the sample invoice data."""
-    return SAMPLE_INVOICES
\ No newline at end of file
+    """Return the invoice data as a shared columnar store.
+    
+    Set INVOICE_DATA_FILE to a JSONL or CSV export to stream it in instead
+    of using the sample invoices. Set INVOICE_SNAPSHOT to a file path to
+    memory-map the store and its indexes from a snapshot there, which is
+    rebuilt whenever the source data changes.
+    """
+    global _store
+    if _store is None:
+        snapshot = os.environ.get('INVOICE_SNAPSHOT')
+        if snapshot:
+            from invoice_snapshot import fingerprint_data, fingerprint_file, open_or_build
+            path = os.environ.get('INVOICE_DATA_FILE')
+            fingerprint = fingerprint_file(path) if path else fingerprint_data(SAMPLE_INVOICES)
+            _store = open_or_build(snapshot, fingerprint, load_source)
+        else:
+            _store = load_source()
+    return _store
\ No newline at end of file
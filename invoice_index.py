@@ -0,0 +1,150 @@
+"""
+Incrementally maintained sorted indexes over invoice columns.
+"""
+
+import numpy as np
+
+
+def lower_bound(keys, key):
+    """Position of the first of a sorted run's keys that is >= key.
+    
+    A string key longer than the run's strings would make NumPy widen the
+    whole run to compare them; no key of the run can have it as a prefix,
+    so cutting it to the run's width and searching past it is the same.
+    """
+    width = keys.dtype.itemsize // 4
+    if keys.dtype.kind == 'U' and isinstance(key, str) and len(key) > width:
+        return np.searchsorted(keys, key[:width], side='right')
+    return np.searchsorted(keys, key, side='left')
+
+
+class SortedIndex:
+    def __init__(self, dtype):
+        """Initialize an empty index over keys of the given dtype."""
+        self.dtype = np.dtype(dtype)
+        # Runs of [keys, rows, live, dead] sorted by (key, row), largest
+        # first. Runs are merged like a binary counter, so adding k rows
+        # costs O(k log n) amortized and there are never more than O(log n)
+        # runs to search. Removed entries are only marked dead, and are
+        # dropped when their run is merged or once half of it is dead.
+        self._runs = []
+    
+    @classmethod
+    def from_sorted(cls, dtype, keys, rows):
+        """Create an index from arrays already sorted by (key, row), without copying them."""
+        index = cls(dtype)
+        if len(keys):
+            index._runs.append([keys, rows, np.ones(len(keys), dtype=np.bool_), 0])
+        return index
+    
+    def __len__(self):
+        return sum(len(keys) - dead for keys, _, _, dead in self._runs)
+    
+    def add(self, keys, rows):
+        """Index rows under the given keys."""
+        run_keys = np.asarray(keys, dtype=self.dtype)
+        run_rows = np.asarray(rows, dtype=np.int64)
+        if not len(run_keys):
+            return
+        
+        while self._runs and len(self._runs[-1][0]) <= len(run_keys):
+            prev_keys, prev_rows, live, dead = self._runs.pop()
+            if dead:
+                prev_keys, prev_rows = prev_keys[live], prev_rows[live]
+            run_keys = np.concatenate([prev_keys, run_keys])
+            run_rows = np.concatenate([prev_rows, run_rows])
+        
+        if np.all(run_rows[1:] > run_rows[:-1]):
+            # Rows already ascending, as for freshly appended invoices
+            order = np.argsort(run_keys, kind='stable')
+        else:
+            order = np.lexsort((run_rows, run_keys))
+        self._runs.append([run_keys[order], run_rows[order], np.ones(len(order), dtype=np.bool_), 0])
+    
+    def remove(self, key, row):
+        """Remove one row indexed under key; return whether it was found."""
+        key = np.asarray(key, dtype=self.dtype)
+        for i, run in enumerate(self._runs):
+            keys, rows, live, dead = run
+            lo = np.searchsorted(keys, key, side='left')
+            hi = np.searchsorted(keys, key, side='right')
+            at = lo + np.searchsorted(rows[lo:hi], row)
+            if at < hi and rows[at] == row and live[at]:
+                live[at] = False
+                run[3] = dead = dead + 1
+                if 2 * dead >= len(keys):
+                    self._compact(i)
+                return True
+        return False
+    
+    def _compact(self, i):
+        keys, rows, live, _ = self._runs[i]
+        if live.any():
+            self._runs[i] = [keys[live], rows[live], np.ones(int(live.sum()), dtype=np.bool_), 0]
+        else:
+            del self._runs[i]
+    
+    def items(self):
+        """Get the keys and rows of every live entry, sorted by (key, row)."""
+        if len(self._runs) == 1 and not self._runs[0][3]:
+            return self._runs[0][0], self._runs[0][1]
+        keys = np.concatenate([keys[live] for keys, _, live, _ in self._runs] or [np.empty(0, self.dtype)])
+        rows = np.concatenate([rows[live] for _, rows, live, _ in self._runs] or [np.empty(0, np.int64)])
+        order = np.lexsort((rows, keys))
+        return keys[order], rows[order]
+    
+    def select(self, start=None, stop=None):
+        """Get rows with start <= key < stop in key order; None is unbounded."""
+        key_parts, row_parts = [], []
+        for keys, rows, live, dead in self._runs:
+            lo = 0 if start is None else lower_bound(keys, start)
+            hi = len(keys) if stop is None else lower_bound(keys, stop)
+            if lo < hi:
+                part = slice(lo, hi)
+                if dead:
+                    part = np.flatnonzero(live[lo:hi]) + lo
+                key_parts.append(keys[part])
+                row_parts.append(rows[part])
+        
+        if not row_parts:
+            return np.empty(0, dtype=np.int64)
+        if len(row_parts) == 1:
+            return row_parts[0]
+        
+        keys = np.concatenate(key_parts)
+        rows = np.concatenate(row_parts)
+        return rows[np.lexsort((rows, keys))]
+    
+    def smallest(self, n):
+        """Get the rows with the n smallest keys in key order, ties in row order."""
+        return self._extreme(n, largest=False)
+    
+    def largest(self, n):
+        """Get the rows with the n largest keys, largest first, ties in row order."""
+        return self._extreme(n, largest=True)
+    
+    def _extreme(self, n, largest):
+        # The n extremes overall are among the n live extremes of each run,
+        # which lie within n + dead entries of its end. Runs hold ties in
+        # row order, so the largest end of a run is widened to every row
+        # tied with the first key it could need.
+        if n <= 0 or not self._runs:
+            return np.empty(0, dtype=np.int64)
+        key_parts, row_parts = [], []
+        for keys, rows, live, dead in self._runs:
+            if largest:
+                lo = np.searchsorted(keys, keys[max(len(keys) - n - dead, 0)], side='left')
+                part = slice(lo, None)
+            else:
+                lo = 0
+                part = slice(None, n + dead)
+            if dead:
+                part = np.flatnonzero(live[part]) + lo
+            key_parts.append(keys[part])
+            row_parts.append(rows[part])
+        keys = np.concatenate(key_parts)
+        rows = np.concatenate(row_parts)
+        if keys.dtype.kind == 'M':
+            keys = keys.view(np.int64)
+        order = np.lexsort((rows, -keys if largest else keys))
+        return rows[order[:n]]
\ No newline at end of file
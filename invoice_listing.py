@@ -0,0 +1,98 @@
+"""
+Paginated invoice listings, rendered one line at a time.
+
+Listing handlers return a Listing instead of one big string. It holds the
+row positions found by the parser's indexes, so the total is known up
+front, and renders only the lines of the requested page, as they are
+iterated. Pages are addressed by limit and offset, or by a cursor naming
+the last invoice shown, which stays valid when invoices before it are
+added or removed.
+"""
+
+import os
+import re
+import numpy as np
+from invoice_store import LiveRows
+
+
+PAGE_SIZE = int(os.environ.get('INVOICE_PAGE_SIZE') or 20)
+
+# A row, or a key and a row, as Listing.cursor writes them
+CURSOR_RE = re.compile(r"(-?\d+\.)?\d+")
+
+
+class CursorError(ValueError):
+    """A cursor that does not name an invoice of the listing it is used with."""
+
+
+class Listing:
+    def __init__(self, header, rows, render, keys=None, limit=PAGE_SIZE, offset=0, cursor=None, more=None):
+        """Page through rows sorted by (key, row), keys being a column indexed by row (None: by row alone)."""
+        self.header = header
+        self.rows = rows
+        self.render = render
+        self.keys = keys
+        self.total = len(rows)
+        self.start = self.find(cursor) if cursor else min(max(offset, 0), self.total)
+        self.end = self.total if limit is None else min(self.start + max(limit, 0), self.total)
+        # Called with a cursor to list the next page
+        self.more = more
+    
+    def key(self, row):
+        value = self.keys[row]
+        return int(value.view(np.int64)) if value.dtype.kind == 'M' else int(value)
+    
+    def find(self, cursor):
+        """Position of the first row after the one a cursor names."""
+        if not CURSOR_RE.fullmatch(str(cursor)):
+            raise CursorError(f"'{cursor}' is not a listing cursor")
+        *key, row = (int(part) for part in str(cursor).split('.'))
+        if isinstance(self.rows, LiveRows):
+            return self.rows.rank(row)
+        rows = np.asarray(self.rows)
+        if self.keys is None:
+            return int(np.searchsorted(rows, row, side='right'))
+        if not key:
+            raise CursorError(f"'{cursor}' is not a cursor of this listing")
+        keys = self.keys[rows]
+        if keys.dtype.kind == 'M':
+            keys = keys.view(np.int64)
+        lo = np.searchsorted(keys, key[0], side='left')
+        hi = np.searchsorted(keys, key[0], side='right')
+        return int(lo + np.searchsorted(rows[lo:hi], row, side='right'))
+    
+    @property
+    def cursor(self):
+        """Cursor for the page after this one, or None on the last page."""
+        if self.end >= self.total:
+            return None
+        row = int(self.rows[self.end - 1])
+        return str(row) if self.keys is None else f"{self.key(row)}.{row}"
+    
+    def next_page(self):
+        """The next page of the same listing, or None if this is the last one."""
+        cursor = self.cursor
+        return self.more(cursor=cursor) if cursor and self.more else None
+    
+    def __iter__(self):
+        """Yield the header, one rendered line per invoice on the page, and a footer if paged."""
+        yield self.header
+        for row in self.rows[self.start:self.end]:
+            yield self.render(int(row))
+        if self.start >= self.end:
+            yield f"No more invoices to show ({self.total} in total)."
+        elif self.start or self.end < self.total:
+            footer = f"Showing {self.start + 1}-{self.end} of {self.total}"
+            if self.end < self.total:
+                footer += "; say 'more' for the next page"
+            yield footer + "."
+    
+    def __str__(self):
+        return "\n".join(self)
+
+
+def iter_lines(response):
+    """Yield a handler's response in printable pieces, a Listing line by line."""
+    lines = [response] if isinstance(response, str) else response
+    for i, line in enumerate(lines):
+        yield line if not i else "\n" + line
\ No newline at end of file
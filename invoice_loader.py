@@ -0,0 +1,105 @@
+"""
+Streaming JSONL/CSV invoice loader with incremental append support.
+"""
+
+import csv
+import json
+import os
+import time
+
+
+def _parse_bool(value):
+    """Interpret a CSV cell as a boolean."""
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y', 'paid')
+
+
+class InvoiceFileLoader:
+    def __init__(self, path, file_format=None, chunk_size=10000):
+        """Initialize a loader for a JSONL or CSV invoice export."""
+        self.path = path
+        self.file_format = file_format or os.path.splitext(path)[1].lstrip('.').lower()
+        if self.file_format not in ('jsonl', 'csv'):
+            raise ValueError(f"Unsupported invoice file format: {self.file_format!r}")
+        self.chunk_size = chunk_size
+        self.offset = 0
+        self.fieldnames = None
+    
+    def parse_row(self, row):
+        """Turn one JSONL line or CSV row into an invoice dict; None for a blank line or the CSV header."""
+        if self.file_format == 'jsonl':
+            return json.loads(row) if row.strip() else None
+        if not row:
+            return None
+        if self.fieldnames is None:
+            self.fieldnames = row
+            return None
+        
+        invoice = dict(zip(self.fieldnames, row))
+        invoice['total'] = float(invoice['total'].replace(',', '').lstrip('$'))
+        if 'paid' in invoice:
+            invoice['paid'] = _parse_bool(invoice['paid'])
+        return invoice
+    
+    def records(self, f):
+        """Yield (invoice or None, bytes read) for each complete record from f's position.
+        
+        CSV rows go through one csv.reader, so quoted fields may span lines.
+        """
+        read = {'bytes': 0, 'ended': False}
+        
+        def lines():
+            for raw in f:
+                # A line without its newline is still being written; leave
+                # it for the next refresh.
+                if not raw.endswith(b'\n'):
+                    break
+                read['bytes'] += len(raw)
+                yield raw.decode('utf-8')
+            read['ended'] = True
+        
+        rows = lines() if self.file_format == 'jsonl' else csv.reader(lines())
+        for row in rows:
+            # A row is only cut short by the end of the lines when a quoted
+            # field is still open; it is finished by a later refresh.
+            if read['ended']:
+                return
+            size, read['bytes'] = read['bytes'], 0
+            yield self.parse_row(row), size
+    
+    def read_chunks(self):
+        """Yield lists of at most chunk_size invoices from the current offset."""
+        if os.path.getsize(self.path) < self.offset:
+            raise ValueError(f"{self.path} shrank since it was last read; a full reload is required.")
+        
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            chunk = []
+            for invoice, size in self.records(f):
+                if invoice is not None:
+                    chunk.append(invoice)
+                self.offset += size
+                
+                if len(chunk) >= self.chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+    
+    def load_into(self, parser):
+        """Append every unread invoice to the parser and return the count."""
+        count = 0
+        for chunk in self.read_chunks():
+            parser.add_invoices(chunk)
+            count += len(chunk)
+        return count
+    
+    def follow(self, parser, interval=1.0):
+        """Tail the file, indexing new invoices as they are appended."""
+        while True:
+            count = self.load_into(parser)
+            if count:
+                yield count
+            else:
+                time.sleep(interval)
\ No newline at end of file
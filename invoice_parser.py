@@ -2,56 +2,506 @@
 Invoice parsing and query functions.
 """
 
-from datetime import datetime, timedelta
+import heapq
+from datetime import date, datetime, timedelta
+from functools import wraps
+import numpy as np
 from dateutil.parser import parse
 from invoice_data import get_invoices
+from invoice_index import SortedIndex
+from invoice_store import LiveRows
+from metrics import timed
+
+
+def vendor_key(name):
+    """Normalize a vendor name for index lookups."""
+    return name.strip().casefold()
+
+
+@timed('date_parsing')
+def to_date(value):
+    """Coerce a date, datetime or date string to a date."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return parse(value).date()
+
+
+def to_day(value):
+    """Coerce a date, datetime or date string to a NumPy day."""
+    return np.datetime64(to_date(value), 'D')
+
+
+DUE_PERIODS = ('day', 'week', 'month')
+
+
+def period_starts(days, period):
+    """First day of the day, week (from Monday) or month containing each NumPy day."""
+    if period == 'week':
+        # 1970-01-01, day zero, was a Thursday
+        return days - (days.astype(np.int64) + 3) % 7
+    if period == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    return days
+
+
+def new_stats(**fields):
+    """Empty invoice count, total, open count and open balance aggregates, in cents."""
+    return {**fields, 'count': 0, 'total': 0, 'open_count': 0, 'open_balance': 0}
+
+
+def add_stats(stats, count, total, open_count, open_balance):
+    """Add to (or, with negative amounts, subtract from) a set of aggregates."""
+    stats['count'] += int(count)
+    stats['total'] += int(total)
+    stats['open_count'] += int(open_count)
+    stats['open_balance'] += int(open_balance)
+
+
+def in_dollars(stats):
+    """Copy of a set of aggregates with its amounts in dollars."""
+    return {**stats, 'total': stats['total'] / 100, 'open_balance': stats['open_balance'] / 100}
+
+
+def cents_above(amount):
+    """Smallest whole number of cents strictly above a dollar amount."""
+    cents = amount * 100
+    # 0.29 * 100 is 28.999..., which stands for 29 cents
+    nearest = round(cents)
+    return nearest + 1 if abs(cents - nearest) < 1e-6 else int(np.floor(cents)) + 1
+
+
+def group_stats(group_ids, totals, unpaid, rows=None):
+    """Yield (group id, rows, count, total, open count, open balance) for each integer or day group id.
+    
+    Group ids are counted with bincount over their range, which is small
+    for vendor ids and due dates. Totals are in cents, which float64 sums
+    exactly. Rows are only split out if given.
+    """
+    if not len(group_ids):
+        return
+    ids = group_ids.view(np.int64) if group_ids.dtype.kind == 'M' else group_ids.astype(np.int64)
+    low = ids.min()
+    ids = ids - low
+    counts = np.bincount(ids)
+    sums = np.bincount(ids, weights=totals)
+    open_counts = np.bincount(ids, weights=unpaid)
+    open_sums = np.bincount(ids, weights=totals * unpaid)
+    present = np.flatnonzero(counts)
+    if rows is not None:
+        order = np.argsort(ids, kind='stable')
+        group_rows = np.split(rows[order], np.cumsum(counts[present])[:-1])
+    groups = (present + low).astype(group_ids.dtype)
+    for g, i in enumerate(present):
+        group = group_rows[g] if rows is not None else None
+        yield groups[g], group, counts[i], sums[i], open_counts[i], open_sums[i]
+
+
+def fresh(method):
+    """Decorator that brings a parser's indexes up to date with its store before a query."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self.refresh()
+        return method(self, *args, **kwargs)
+    return wrapper
 
 
 class InvoiceParser:
-    def __init__(self):
-        self.invoices = get_invoices()
+    def __init__(self, invoices=None):
+        self.invoices = get_invoices() if invoices is None else invoices
+        self._display_dates = {}
+        state = self.invoices.index_snapshot
+        if state is not None and state['version'] == self.invoices.version:
+            self.restore_indexes(state)
+        else:
+            self.build_indexes()
     
-    def get_invoices_due_in_days(self, days=7):
-        """Get invoices due within the specified number of days."""
-        today = datetime.now().date()
-        target_date = today + timedelta(days=days)
+    def build_indexes(self):
+        """Build the sorted indexes and aggregates over the invoice columns."""
+        self._due_index = SortedIndex('datetime64[D]')
+        self._open_due_index = SortedIndex('datetime64[D]')
+        self._issued_index = SortedIndex('datetime64[D]')
+        self._amount_index = SortedIndex(np.int64)
+        self._summary = new_stats()
+        self._due_buckets = {period: {} for period in DUE_PERIODS}
+        self._vendor_keys = {}
+        self._vendor_key_names = []
+        self._key_of_vendor = []
+        self._vendor_positions = {}
+        self._vendor_stats = {}
+        self._indexed = 0
+        # Changes already in the store are seen as the rows are indexed
+        self._changes = len(self.invoices.changes)
+        self.refresh()
+    
+    def index_state(self):
+        """Export the indexes and aggregates as arrays and plain data, e.g. for a snapshot."""
+        self.refresh()
+        return {
+            'version': self.invoices.version,
+            'indexes': {
+                'due': self._due_index.items(),
+                'open_due': self._open_due_index.items(),
+                'issued': self._issued_index.items(),
+                'amount': self._amount_index.items()
+            },
+            'summary': dict(self._summary),
+            'due_buckets': {period: dict(buckets) for period, buckets in self._due_buckets.items()},
+            'vendor_key_names': list(self._vendor_key_names),
+            'key_of_vendor': list(self._key_of_vendor),
+            'vendor_stats': {key: dict(stats) for key, stats in self._vendor_stats.items()},
+            'vendor_positions': {
+                key: np.fromiter(positions, dtype=np.int64, count=len(positions))
+                for key, positions in self._vendor_positions.items()
+            }
+        }
+    
+    def restore_indexes(self, state):
+        """Adopt indexes and aggregates exported by index_state() instead of building them."""
+        indexes = state['indexes']
+        self._due_index = SortedIndex.from_sorted('datetime64[D]', *indexes['due'])
+        self._open_due_index = SortedIndex.from_sorted('datetime64[D]', *indexes['open_due'])
+        self._issued_index = SortedIndex.from_sorted('datetime64[D]', *indexes['issued'])
+        self._amount_index = SortedIndex.from_sorted(np.int64, *indexes['amount'])
+        self._summary = dict(state['summary'])
+        self._due_buckets = {period: dict(buckets) for period, buckets in state['due_buckets'].items()}
+        self._vendor_key_names = list(state['vendor_key_names'])
+        self._vendor_keys = {key: k for k, key in enumerate(self._vendor_key_names)}
+        self._key_of_vendor = list(state['key_of_vendor'])
+        self._vendor_stats = {key: dict(stats) for key, stats in state['vendor_stats'].items()}
+        # Row arrays are only turned into editable dicts when a vendor changes
+        self._vendor_positions = dict(state['vendor_positions'])
+        self._indexed = len(self.invoices)
+        self._changes = len(self.invoices.changes)
+    
+    def editable_positions(self, key):
+        """A vendor's positions as an insertion-ordered dict of rows, creating it if needed."""
+        positions = self._vendor_positions.get(key)
+        if positions is None:
+            positions = self._vendor_positions[key] = {}
+        elif isinstance(positions, np.ndarray):
+            positions = self._vendor_positions[key] = dict.fromkeys(positions.tolist())
+        return positions
+    
+    def refresh(self):
+        """Catch up with the store: redo rows changed and index rows appended since the last refresh.
+        
+        The store may be shared with other parsers, so edits made through
+        them are picked up from its change log here.
+        """
+        if self._changes < len(self.invoices.changes):
+            self.reindex(self.invoices.changes[self._changes:])
+        start, end = self._indexed, len(self.invoices)
+        if start < end:
+            self.index_rows(start, end)
+        return end - start
+    
+    def reindex(self, changes):
+        """Move rows changed in the store from the index entries of their old values to their new ones."""
+        previous = {}
+        for row, values in changes:
+            # Rows not indexed yet are added as they are now
+            if row >= self._indexed:
+                continue
+            # A row's oldest values are the ones it was indexed with; rows are
+            # redone in the order of their last change, as the parser that
+            # made the changes moved them.
+            old = previous.pop(row, {})
+            for key, value in (values or {}).items():
+                old.setdefault(key, value)
+            previous[row] = old
+        self._changes += len(changes)
+        for row, old in previous.items():
+            self.index_row(row, -1, old)
+            if row not in self.invoices.deleted:
+                self.index_row(row, 1)
+    
+    def close(self):
+        """Release the parser's resources; a single-process parser holds none."""
+    
+    def add_invoices(self, invoices):
+        """Append invoice dicts and index only the new rows."""
+        rows = self.invoices.extend(invoices)
+        self.refresh()
+        return rows
+    
+    def add_invoice(self, invoice):
+        """Append one invoice dict and return its row position."""
+        return self.add_invoices([invoice])[0]
+    
+    def update_invoice(self, row, **changes):
+        """Change fields of an invoice, moving it between indexes and aggregates."""
+        self.refresh()
+        row = self.invoices.check_row(row)
+        # A bad value raises here, before the row leaves its indexes
+        self.invoices.convert(changes)
+        self.index_row(row, -1)
+        self.invoices.update(row, changes)
+        self.index_row(row, 1)
+        self._changes = len(self.invoices.changes)
+    
+    def mark_paid(self, row, paid=True):
+        """Mark an invoice as paid (or open again)."""
+        self.update_invoice(row, paid=paid)
+    
+    def delete_invoice(self, row):
+        """Delete an invoice and remove it from every index and aggregate."""
+        self.refresh()
+        row = self.invoices.check_row(row)
+        self.index_row(row, -1)
+        self.invoices.delete(row)
+        self._changes = len(self.invoices.changes)
+    
+    def sync_vendor_keys(self):
+        """Map vendor ids added to the store since the last call to casefolded keys."""
+        for name in self.invoices.vendors[len(self._key_of_vendor):]:
+            key = vendor_key(name)
+            if key not in self._vendor_keys:
+                self._vendor_keys[key] = len(self._vendor_key_names)
+                self._vendor_key_names.append(key)
+            self._key_of_vendor.append(self._vendor_keys[key])
+    
+    def index_rows(self, start, end):
+        """Add store rows [start, end) to the indexes."""
+        store = self.invoices
+        rows = np.arange(start, end)
+        if store.deleted:
+            rows = rows[~store.deleted_mask[rows]]
+        due = store.due_date[rows]
+        totals = store.cents[rows]
+        unpaid = ~store.paid[rows]
+        
+        # Dates and amounts go into sorted indexes so range and ranking
+        # queries are binary searches whose cost follows the result size.
+        self._due_index.add(due, rows)
+        self._open_due_index.add(due[unpaid], rows[unpaid])
+        self._issued_index.add(store.invoice_date[rows], rows)
+        self._amount_index.add(totals, rows)
+        
+        # Casefolded vendor name -> positions, with per-vendor aggregates
+        # updated by a vectorized group-by over only the new rows.
+        self.sync_vendor_keys()
+        row_keys = np.asarray(self._key_of_vendor, dtype=np.int32)[store.vendor_id[rows]]
+        for k, group, *sums in group_stats(row_keys, totals, unpaid, rows):
+            key = self._vendor_key_names[k]
+            stats = self._vendor_stats.get(key)
+            if stats is None:
+                stats = self._vendor_stats[key] = new_stats(vendor=store.vendors[store.vendor_id[group[0]]])
+            self.editable_positions(key).update(dict.fromkeys(group.tolist()))
+            add_stats(stats, *sums)
+        
+        for period, buckets in self._due_buckets.items():
+            for day, _, *sums in group_stats(period_starts(due, period), totals, unpaid):
+                add_stats(buckets.setdefault(day.item(), new_stats()), *sums)
+        
+        add_stats(self._summary, len(rows), totals.sum(), unpaid.sum(), totals[unpaid].sum())
+        self._indexed = end
+    
+    def index_row(self, row, sign, previous=None):
+        """Add (sign 1) or remove (sign -1) one indexed row, in O(log n).
+        
+        previous holds column values, as recorded in the store's change
+        log, to use instead of the store's current ones.
+        """
+        store = self.invoices
+        previous = previous or {}
+        due = previous.get('due_date', store.due_date[row])
+        issued = previous.get('invoice_date', store.invoice_date[row])
+        total = int(previous.get('total', store.cents[row]))
+        unpaid = not previous.get('paid', store.paid[row])
+        vendor_id = previous.get('vendor', store.vendor_id[row])
+        
+        if sign > 0:
+            self._due_index.add([due], [row])
+            self._issued_index.add([issued], [row])
+            self._amount_index.add([total], [row])
+            if unpaid:
+                self._open_due_index.add([due], [row])
+        else:
+            self._due_index.remove(due, row)
+            self._issued_index.remove(issued, row)
+            self._amount_index.remove(total, row)
+            if unpaid:
+                self._open_due_index.remove(due, row)
         
-        due_invoices = []
-        for invoice in self.invoices:
-            due_date = parse(invoice['due_date']).date()
-            if today <= due_date <= target_date:
-                due_invoices.append(invoice)
+        sums = (sign, sign * total, sign * unpaid, sign * total * unpaid)
+        self.sync_vendor_keys()
+        key = self._vendor_key_names[self._key_of_vendor[vendor_id]]
+        if key not in self._vendor_stats:
+            self._vendor_stats[key] = new_stats(vendor=store.vendors[vendor_id])
+        add_stats(self._vendor_stats[key], *sums)
+        if sign > 0:
+            self.editable_positions(key)[row] = None
+        else:
+            del self.editable_positions(key)[row]
+        if not self._vendor_stats[key]['count']:
+            del self._vendor_stats[key], self._vendor_positions[key]
         
-        return due_invoices
+        for period, buckets in self._due_buckets.items():
+            day = period_starts(due, period).item()
+            stats = buckets.setdefault(day, new_stats())
+            add_stats(stats, *sums)
+            if not stats['count']:
+                del buckets[day]
+        
+        add_stats(self._summary, *sums)
+    
+    @timed('query')
+    @fresh
+    def get_due_rows(self, start, end):
+        """Get row positions of invoices due within [start, end], in due date order."""
+        return self._due_index.select(to_day(start), to_day(end) + 1)
+    
+    def get_due_rows_in_days(self, days=7):
+        """Get row positions of invoices due within the specified number of days."""
+        today = datetime.now().date()
+        return self.get_due_rows(today, today + timedelta(days=days))
+    
+    def get_invoices_due_between(self, start, end):
+        """Get invoices due within the inclusive range [start, end]."""
+        return self.invoices.rows(self.get_due_rows(start, end))
+    
+    def get_invoices_due_in_days(self, days=7):
+        """Get invoices due within the specified number of days."""
+        return self.invoices.rows(self.get_due_rows_in_days(days))
+    
+    @fresh
+    def get_live_rows(self):
+        """Get row positions of every invoice that has not been deleted, as a lazily sliced sequence."""
+        return LiveRows(self.invoices)
     
+    @timed('query')
+    @fresh
     def get_invoice_by_vendor(self, vendor_name):
         """Get invoice by vendor name (case insensitive)."""
-        for invoice in self.invoices:
-            if invoice['vendor'].lower() == vendor_name.lower():
-                return invoice
-        return None
+        positions = self._vendor_positions.get(vendor_key(vendor_name), ())
+        return self.invoices[int(next(iter(positions)))] if len(positions) else None
+    
+    @timed('query')
+    @fresh
+    def find_vendor(self, phrase):
+        """Find the longest leading run of words in a phrase that names a known vendor."""
+        words = phrase.split()
+        for n in range(len(words), 0, -1):
+            name = " ".join(words[:n])
+            if vendor_key(name) in self._vendor_stats:
+                return name
+        return words[0] if words else phrase
+    
+    @timed('query')
+    @fresh
+    def get_invoices_by_vendor(self, vendor_name):
+        """Get all invoices from a vendor (case insensitive)."""
+        positions = self._vendor_positions.get(vendor_key(vendor_name), {})
+        return self.invoices.rows(positions)
+    
+    @timed('query')
+    @fresh
+    def get_vendor_summary(self, vendor_name):
+        """Get invoice count, total, open count and open balance for a vendor."""
+        stats = self._vendor_stats.get(vendor_key(vendor_name))
+        return in_dollars(stats) if stats else None
+    
+    @timed('query')
+    @fresh
+    def get_ledger_summary(self):
+        """Get invoice count, total, open count and open balance across all vendors."""
+        return in_dollars(self._summary)
+    
+    @timed('query')
+    @fresh
+    def get_vendor_totals(self):
+        """Get the summed invoice total for every vendor."""
+        return {stats['vendor']: stats['total'] / 100 for stats in self._vendor_stats.values()}
+    
+    @timed('query')
+    @fresh
+    def get_rows_above_amount(self, amount):
+        """Get row positions of invoices with total above specified amount, in row order."""
+        return np.sort(self._amount_index.select(start=cents_above(amount)))
     
     def get_invoices_above_amount(self, amount):
         """Get invoices with total above specified amount."""
-        return [inv for inv in self.invoices if inv['total'] > amount]
+        return self.invoices.rows(self.get_rows_above_amount(amount))
     
-    def get_overdue_invoices(self):
-        """Get invoices that are overdue."""
-        today = datetime.now().date()
-        overdue = []
+    @timed('query')
+    @fresh
+    def get_total_amount(self):
+        """Get the summed total of all invoices."""
+        return self._summary['total'] / 100
+    
+    @timed('query')
+    def get_top_invoices(self, n=5):
+        """Get the n invoices with the largest totals, largest first."""
+        return self.get_ranked_invoices('total', n)
+    
+    @timed('query')
+    @fresh
+    def get_ranked_invoices(self, field='total', n=1, largest=True, vendor_name=None):
+        """Get the n invoices with the largest or smallest total, due date or invoice date.
         
-        for invoice in self.invoices:
-            due_date = parse(invoice['due_date']).date()
-            if due_date < today:
-                overdue.append(invoice)
+        Global rankings come straight from the sorted indexes; a vendor's
+        ranking sorts only that vendor's invoices.
+        """
+        if vendor_name is None:
+            index = {'total': self._amount_index, 'due_date': self._due_index, 'invoice_date': self._issued_index}[field]
+            return self.invoices.rows(index.largest(n) if largest else index.smallest(n))
         
-        return overdue
+        positions = np.fromiter(self._vendor_positions.get(vendor_key(vendor_name), {}), dtype=np.int64)
+        values = getattr(self.invoices, 'cents' if field == 'total' else field)[positions]
+        if values.dtype.kind == 'M':
+            values = values.view(np.int64)
+        order = np.lexsort((positions, -values if largest else values))
+        return self.invoices.rows(positions[order[:n]])
+    
+    @timed('query')
+    @fresh
+    def get_ranked_vendors(self, by='total', n=1, largest=True):
+        """Get summaries of the n vendors with the largest or smallest total, open balance or count."""
+        pick = heapq.nlargest if largest else heapq.nsmallest
+        return [in_dollars(stats) for stats in pick(n, self._vendor_stats.values(), key=lambda stats: stats[by])]
+    
+    @timed('query')
+    def get_due_buckets(self, period='week', start=None, end=None):
+        """Get invoice count, total, open count and open balance per day, week or month of due date.
+        
+        Buckets are in date order, optionally limited to those overlapping
+        the inclusive range [start, end].
+        """
+        buckets = self.due_bucket_stats(period)
+        first = period_starts(to_day(start), period).item() if start is not None else None
+        last = to_date(end) if end is not None else None
+        return [
+            {'start': day.isoformat(), **in_dollars(buckets[day])}
+            for day in sorted(buckets)
+            if (first is None or day >= first) and (last is None or day <= last)
+        ]
+    
+    @fresh
+    def due_bucket_stats(self, period):
+        """Day -> aggregates in cents for each due-date bucket of a period."""
+        return self._due_buckets[period]
+    
+    @timed('query')
+    @fresh
+    def get_overdue_rows(self):
+        """Get row positions of unpaid invoices past their due date, in due date order."""
+        today = datetime.now().date()
+        return self._open_due_index.select(stop=to_day(today))
+    
+    def get_overdue_invoices(self):
+        """Get unpaid invoices that are past their due date."""
+        return self.invoices.rows(self.get_overdue_rows())
     
     def format_currency(self, amount):
         """Format amount as currency."""
         return f"${amount:,.2f}"
     
+    @timed('date_parsing')
     def format_date(self, date_str):
-        """Format date string for display."""
-        date_obj = parse(date_str)
-        return date_obj.strftime("%b %d, %Y")
\ No newline at end of file
+        """Format a date or date string for display, parsing each distinct value once."""
+        text = self._display_dates.get(date_str)
+        if text is None:
+            text = self._display_dates[date_str] = to_date(date_str).strftime("%b %d, %Y")
+        return text
\ No newline at end of file
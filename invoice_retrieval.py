@@ -0,0 +1,292 @@
+"""
+Lightweight inverted index for picking the invoices relevant to a question.
+
+Model prompts only include the top-k invoices returned here, so their
+size stays bounded no matter how many invoices are loaded.
+
+Rather than a posting list per term, the retriever keeps sorted indexes
+over the store's vendor, date, amount and invoice number columns, built
+with one vectorized sort each, and looks terms up as key ranges in them.
+"""
+
+import math
+import re
+import threading
+import weakref
+import numpy as np
+from invoice_index import SortedIndex
+
+
+MONTHS = ['january', 'february', 'march', 'april', 'may', 'june', 'july',
+          'august', 'september', 'october', 'november', 'december']
+
+AMOUNT_BUCKET = 1000
+
+WORD_RE = re.compile(r"[a-z0-9][a-z0-9&.'-]*")
+DATE_RE = re.compile(r"\b(\d{4})-(\d{2})(?:-(\d{2}))?\b")
+AMOUNT_RE = re.compile(r"\$\s*(\d[\d,]*(?:\.\d+)?)|\b(\d{1,3}(?:,\d{3})+(?:\.\d+)?)\b")
+EMPTY = np.empty(0, dtype=np.int64)
+
+# Month name or abbreviation -> 0-based month number
+MONTH_NUMBERS = {name[:n]: i for i, name in enumerate(MONTHS) for n in (3, len(name))}
+
+DUE_WORDS = {'due', 'earliest', 'latest', 'soonest', 'overdue', 'late', 'date', 'dates', 'when'}
+
+# Digit runs in invoice numbers are indexed by value up to this bound;
+# longer ones are only found through the whole number.
+MAX_DIGITS_VALUE = 10 ** 18
+
+
+def digit_runs(numbers):
+    """Position and value of every run of ASCII digits in an array of strings.
+    
+    The strings are read as a 2D array of code points and scanned a column
+    at a time, so the work is vectorized over all of them.
+    """
+    width = numbers.dtype.itemsize // 4
+    codes = numbers.view(np.uint32).reshape(len(numbers), width).astype(np.int64) - ord('0')
+    digits = (codes >= 0) & (codes <= 9)
+    value = np.zeros(len(numbers), dtype=np.int64)
+    positions, values = [], []
+    for j in range(width):
+        # Capped so a long run cannot overflow; it is then left out
+        value = np.where(digits[:, j], np.minimum(value, MAX_DIGITS_VALUE // 10) * 10 + codes[:, j], 0)
+        ends = digits[:, j] & ~digits[:, j + 1] if j + 1 < width else digits[:, j]
+        ends &= value < MAX_DIGITS_VALUE
+        positions.append(np.flatnonzero(ends))
+        values.append(value[ends])
+    if not positions:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    positions, values = np.concatenate(positions), np.concatenate(values)
+    # A number repeating a run is indexed under it once
+    order = np.lexsort((values, positions))
+    positions, values = positions[order], values[order]
+    first = np.ones(len(order), dtype=np.bool_)
+    first[1:] = (positions[1:] != positions[:-1]) | (values[1:] != values[:-1])
+    return positions[first], values[first]
+
+
+def query_terms(query):
+    """Index terms mentioned in a question."""
+    text = query.casefold()
+    terms = set()
+    
+    for year, month, day in DATE_RE.findall(text):
+        if day:
+            terms.add(f"date:{year}-{month}-{day}")
+        terms.add(f"month:{year}-{month}")
+    for dollars, grouped in AMOUNT_RE.findall(text):
+        amount = float((dollars or grouped).replace(',', ''))
+        terms.add(f"amount:{int(amount // AMOUNT_BUCKET)}")
+    
+    # Dates and amounts are consumed above so their digits do not also
+    # match invoice numbers.
+    text = AMOUNT_RE.sub(' ', DATE_RE.sub(' ', text))
+    for word in WORD_RE.findall(text):
+        word = word.strip(".'-")
+        terms.add(f"word:{word}")
+        terms.add(f"number:{word}")
+        if word.isdigit():
+            terms.add(f"number:{word.lstrip('0') or '0'}")
+        if word in MONTHS or word in (m[:3] for m in MONTHS):
+            terms.add(f"month:{word}")
+    return terms
+
+
+_retrievers = weakref.WeakKeyDictionary()
+_retrievers_lock = threading.Lock()
+
+
+def retriever_for(store):
+    """The retriever over a store, shared by every bot and handler using it."""
+    with _retrievers_lock:
+        retriever = _retrievers.get(store)
+        if retriever is None:
+            retriever = _retrievers[store] = InvoiceRetriever(store)
+        return retriever
+
+
+class InvoiceRetriever:
+    def __init__(self, store):
+        """Initialize a retriever over an invoice store; indexing is lazy."""
+        self.store = store
+        self._version = None
+        self._changes = 0
+        self._lock = threading.RLock()
+        self.clear()
+    
+    def clear(self):
+        """Drop every index."""
+        # Invoice numbers are keyed by the casefolded number and by the
+        # value of each run of digits in it.
+        self.vendors = SortedIndex(np.int64)
+        self.due = SortedIndex('datetime64[D]')
+        self.issued = SortedIndex('datetime64[D]')
+        self.amounts = SortedIndex(np.int64)
+        self.numbers = SortedIndex(np.str_)
+        self.digits = SortedIndex(np.int64)
+        # Casefolded word -> ids of the vendors whose name has it
+        self.vendor_words = {}
+        self._vendors = 0
+        self._indexed = 0
+    
+    def refresh(self):
+        """Index invoices appended since the last refresh, and move the ones updated or deleted."""
+        with self._lock:
+            store = self.store
+            if self._version == store.version:
+                return
+            if len(store) < self._indexed:
+                self.clear()
+            self.reindex(store.changes[self._changes:])
+            self._changes = len(store.changes)
+            for vendor_id, name in enumerate(store.vendors[self._vendors:], self._vendors):
+                for word in dict.fromkeys(WORD_RE.findall(name.casefold())):
+                    self.vendor_words.setdefault(word, []).append(vendor_id)
+            self._vendors = len(store.vendors)
+            
+            rows = np.arange(self._indexed, len(store))
+            if store.deleted:
+                rows = rows[~store.deleted_mask[rows]]
+            if len(rows):
+                self.vendors.add(store.vendor_id[rows], rows)
+                self.due.add(store.due_date[rows], rows)
+                self.issued.add(store.invoice_date[rows], rows)
+                self.amounts.add(store.cents[rows], rows)
+                numbers = np.array([store.invoice_numbers[row].casefold() for row in rows.tolist()], dtype=np.str_)
+                self.numbers.add(numbers, rows)
+                positions, values = digit_runs(numbers)
+                self.digits.add(values, rows[positions])
+            self._indexed = len(store)
+            self._version = store.version
+    
+    def reindex(self, changes):
+        """Move indexed rows changed by store updates and deletes from their old keys to their current ones."""
+        store = self.store
+        # Each row's values when it was indexed are the first previous
+        # values logged for it; rows not indexed yet are added afresh.
+        indexed = {}
+        for row, previous in changes:
+            if row < self._indexed:
+                old = indexed.setdefault(row, {})
+                for key, value in (previous or {}).items():
+                    old.setdefault(key, value)
+        
+        for row, old in indexed.items():
+            deleted = row in store.deleted
+            for key, index, column in (('vendor', self.vendors, store.vendor_id),
+                                       ('due_date', self.due, store.due_date),
+                                       ('invoice_date', self.issued, store.invoice_date),
+                                       ('total', self.amounts, store.cents)):
+                # Only paid changed, for instance, leaves every index as it is
+                if key in old or deleted:
+                    index.remove(old.get(key, column[row]), row)
+                    if not deleted:
+                        index.add([column[row]], [row])
+            if 'invoice_number' in old or deleted:
+                self.index_number(old.get('invoice_number', store.invoice_numbers[row]), row, -1)
+                if not deleted:
+                    self.index_number(store.invoice_numbers[row], row, 1)
+    
+    def index_number(self, number, row, sign):
+        """Add (sign 1) or remove (sign -1) one row's invoice number."""
+        numbers = np.array([number.casefold()], dtype=np.str_)
+        _, values = digit_runs(numbers)
+        if sign > 0:
+            self.numbers.add(numbers, [row])
+            self.digits.add(values, [row] * len(values))
+        else:
+            self.numbers.remove(numbers[0], row)
+            for value in values:
+                self.digits.remove(value, row)
+    
+    def postings(self, term):
+        """Rows matching a term from query_terms()."""
+        kind, _, value = term.partition(':')
+        try:
+            if kind == 'word':
+                ids = self.vendor_words.get(value, ())
+                return np.concatenate([self.vendors.select(i, i + 1) for i in ids] or [EMPTY])
+            if kind == 'number':
+                # Keys between value and value + '\x01' can only be value
+                rows = self.numbers.select(value, value + '\x01')
+                if value.isascii() and value.isdigit() and value == (value.lstrip('0') or '0'):
+                    number = int(value)
+                    if number < MAX_DIGITS_VALUE:
+                        rows = np.union1d(rows, self.digits.select(number, number + 1))
+                return rows
+            if kind == 'amount':
+                bucket = int(value) * AMOUNT_BUCKET * 100
+                return self.amounts.select(bucket, bucket + AMOUNT_BUCKET * 100)
+            if kind == 'date':
+                day = np.datetime64(value, 'D')
+                return self.dated([(day, day + 1)])
+            if kind == 'month' and value in MONTH_NUMBERS:
+                # The month in every year with an invoice date or due date
+                return self.dated(self.month_ranges(MONTH_NUMBERS[value]))
+            if kind == 'month':
+                month = np.datetime64(value, 'M')
+                return self.dated([(month.astype('datetime64[D]'), (month + 1).astype('datetime64[D]'))])
+        except ValueError:
+            # Dates like 2025-13 match nothing
+            pass
+        return EMPTY
+    
+    def month_ranges(self, month):
+        """Day ranges of a month (0 for January) in every year the indexed dates span."""
+        store, years = self.store, []
+        for index, column in ((self.due, store.due_date), (self.issued, store.invoice_date)):
+            ends = np.concatenate([index.smallest(1), index.largest(1)])
+            years.extend(column[ends].astype('datetime64[Y]').astype(np.int64))
+        if not years:
+            return []
+        starts = (np.arange(min(years), max(years) + 1) * 12 + month).astype('datetime64[M]')
+        return list(zip(starts.astype('datetime64[D]'), (starts + 1).astype('datetime64[D]')))
+    
+    def dated(self, ranges):
+        """Rows with an invoice date or due date in any of the [start, stop) day ranges."""
+        parts = [index.select(start, stop) for index in (self.due, self.issued) for start, stop in ranges]
+        return np.unique(np.concatenate(parts)) if parts else EMPTY
+    
+    def search(self, query, k=5):
+        """Get up to k row positions most relevant to the question."""
+        with self._lock:
+            self.refresh()
+            n = len(self.store) - len(self.store.deleted)
+            if n <= k:
+                return list(self.store.live_rows())
+            
+            # Score rows by the summed IDF of the terms they share with the
+            # question, so rare terms like invoice numbers dominate. Only
+            # rows in some posting are scored, so the cost follows the
+            # postings rather than the ledger.
+            postings, weights = [], []
+            for term in query_terms(query):
+                rows = self.postings(term)
+                if not len(rows) or len(rows) == n:
+                    continue
+                postings.append(rows)
+                weights.append(np.full(len(rows), math.log(n / len(rows))))
+            if postings:
+                best, inverse = np.unique(np.concatenate(postings), return_inverse=True)
+                scores = np.bincount(inverse, weights=np.concatenate(weights))
+            else:
+                best, scores = EMPTY, np.empty(0)
+            
+            # The k best by score, ties going to the lowest rows
+            if len(best) > k:
+                kth = np.partition(scores, len(best) - k)[len(best) - k]
+                above = best[scores > kth]
+                best = np.concatenate([above, best[scores == kth][:k - len(above)]])
+            best = [int(row) for row in best]
+            if len(best) < k:
+                best.extend(self.fallback(query, k - len(best), set(best)))
+            return sorted(best)
+    
+    def fallback(self, query, k, exclude):
+        """Pick rows for questions that mention no indexed terms: the earliest due, or else the largest."""
+        words = set(WORD_RE.findall(query.casefold()))
+        # Taken from the end of a sorted index, so only k + len(exclude) rows are looked at
+        m = k + len(exclude)
+        candidates = self.due.smallest(m) if words & DUE_WORDS else self.amounts.largest(m)
+        return [int(row) for row in candidates if int(row) not in exclude][:k]
\ No newline at end of file
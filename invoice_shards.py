@@ -0,0 +1,562 @@
+"""
+Sharded execution of InvoiceParser queries across worker processes.
+
+Invoices are partitioned by a stable hash of their casefolded vendor name,
+so each vendor lives on exactly one shard. Every shard is a worker process
+holding an InvoiceParser over its own invoices. Filters and rankings run
+on all shards at once and only their row numbers come back; the
+coordinator merges them in the same (key, row) order the single-process
+parser uses, and sums aggregates in integer cents, so answers are
+identical. Vendor lookups go straight to the vendor's shard.
+
+The coordinator keeps the full store, which stays the source of truth:
+results are views of its rows, and edits are applied to it before being
+forwarded to the shard that owns the invoice, and undone if the shard
+fails to apply them.
+"""
+
+import heapq
+import multiprocessing
+import os
+import threading
+import zlib
+from datetime import datetime
+from itertools import islice
+import numpy as np
+from invoice_data import get_invoices
+from invoice_parser import InvoiceParser, add_stats, cents_above, fresh, in_dollars, new_stats, to_day, vendor_key
+from invoice_store import InvoiceStore
+from metrics import timed
+
+
+# Index name -> store column holding its keys
+INDEX_COLUMNS = {'due': 'due_date', 'open_due': 'due_date', 'issued': 'invoice_date', 'amount': 'cents'}
+RANK_INDEXES = {'total': 'amount', 'due_date': 'due', 'invoice_date': 'issued'}
+
+
+def shard_of(key, shards):
+    """Shard number for a casefolded vendor key, the same in every process."""
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+
+class InvoiceShard:
+    def __init__(self, vendors, rows, invoice_numbers, vendor_id, cents, invoice_date, due_date, paid,
+                 positions=None, vendor_names=None):
+        """Index one shard's invoices; rows holds the ledger row of each shard row.
+        
+        positions and vendor_names carry each vendor's invoice order and
+        display name from a snapshot, where edits may have changed them.
+        """
+        # Shards only answer with ledger rows, so they keep no invoice extras
+        store = InvoiceStore.from_arrays(vendors, invoice_numbers, vendor_id, cents, invoice_date, due_date, paid)
+        self.parser = InvoiceParser(store)
+        self.rows = rows
+        # Whether shard rows are out of ledger order, after an invoice moved here
+        self.reordered = False
+        for key, ledger_rows in (positions or {}).items():
+            self.parser._vendor_positions[key] = dict.fromkeys(np.searchsorted(rows, ledger_rows).tolist())
+        for key, name in (vendor_names or {}).items():
+            self.parser._vendor_stats[key]['vendor'] = name
+    
+    def local(self, row):
+        """Shard row holding a ledger row; the latest one if the invoice moved here more than once."""
+        if not self.reordered:
+            return int(np.searchsorted(self.rows, row))
+        return int(np.flatnonzero(self.rows == row)[-1])
+    
+    def index(self, name):
+        return getattr(self.parser, f'_{name}_index')
+    
+    def column(self, index):
+        return getattr(self.parser.invoices, INDEX_COLUMNS[index])
+    
+    def sync_vendors(self, vendors):
+        """Add vendor names the coordinator has seen since the last call, keeping the same ids."""
+        for name in vendors:
+            self.parser.invoices.encode_vendor(name)
+    
+    def select(self, index, start, stop):
+        """Ledger rows with start <= key < stop in an index."""
+        return self.rows[self.index(index).select(start, stop)]
+    
+    def extreme(self, index, n, largest):
+        """Ledger rows that may be among the n largest or smallest keys of an index."""
+        local = self.index(index).largest(n) if largest else self.index(index).smallest(n)
+        if self.reordered and len(local):
+            # Ties are ordered by shard row, which no longer follows ledger
+            # order, so every row tied with the last one is a candidate.
+            key = self.column(index)[local[-1]]
+            local = np.union1d(local, self.index(index).select(key, key + 1))
+        return self.rows[local]
+    
+    def vendor_rows(self, key, limit=None):
+        """Ledger rows of a vendor's invoices in index order, optionally only the first few."""
+        positions = self.parser._vendor_positions.get(key, ())
+        return self.rows[np.fromiter(islice(positions, limit), dtype=np.int64)]
+    
+    def ranked_vendor_rows(self, key, field, n, largest):
+        """Ledger rows of a vendor's n invoices with the largest or smallest field."""
+        local = np.fromiter(self.parser._vendor_positions.get(key, ()), dtype=np.int64)
+        rows = self.rows[local]
+        values = getattr(self.parser.invoices, 'cents' if field == 'total' else field)[local]
+        if values.dtype.kind == 'M':
+            values = values.view(np.int64)
+        order = np.lexsort((rows, -values if largest else values))
+        return rows[order[:n]]
+    
+    def vendor_stats(self, keys=None):
+        """Aggregates in cents of the given vendor keys, or of every vendor."""
+        stats = self.parser._vendor_stats
+        if keys is None:
+            return stats
+        return {key: stats[key] for key in keys if key in stats}
+    
+    def summary(self):
+        return self.parser._summary
+    
+    def due_buckets(self, period):
+        return self.parser.due_bucket_stats(period)
+    
+    def append(self, vendors, rows, invoice_numbers, vendor_id, cents, invoice_date, due_date, paid):
+        """Add invoices, given as ledger rows and columns, to this shard."""
+        self.sync_vendors(vendors)
+        store = self.parser.invoices
+        names = np.asarray(store.vendors, dtype=object)[vendor_id]
+        store.extend_columns(names, invoice_numbers, invoice_date, due_date, cents / 100, paid)
+        # An invoice moving back keeps its deleted copy here, so equal rows count too
+        if len(self.rows) and len(rows) and rows[0] <= self.rows[-1]:
+            self.reordered = True
+        self.rows = np.concatenate([self.rows, rows])
+        self.parser.refresh()
+    
+    def update(self, vendors, row, changes):
+        """Change fields of the invoice at a ledger row."""
+        self.sync_vendors(vendors)
+        self.parser.update_invoice(self.local(row), **changes)
+    
+    def delete(self, row):
+        """Delete the invoice at a ledger row."""
+        self.parser.delete_invoice(self.local(row))
+
+
+def serve_shard(conn, payload):
+    """Answer (method, args) requests for one shard until the coordinator sends None."""
+    shard = InvoiceShard(**payload)
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        method, args = request
+        try:
+            result = True, getattr(shard, method)(*args)
+        except Exception as e:
+            result = False, e
+        conn.send(result)
+    conn.close()
+
+
+def held_by_shards(name):
+    """An InvoiceParser method over its own indexes, which a sharded parser leaves to its shards."""
+    def method(self, *args, **kwargs):
+        raise NotImplementedError(f"{name}() needs a parser's own indexes; a ShardedInvoiceParser keeps them in its shards")
+    method.__name__ = name
+    return method
+
+
+class ShardedInvoiceParser(InvoiceParser):
+    # Query methods are inherited or routed through the shards; these
+    # build or export the indexes that only the shards hold.
+    build_indexes = held_by_shards('build_indexes')
+    index_state = held_by_shards('index_state')
+    restore_indexes = held_by_shards('restore_indexes')
+    editable_positions = held_by_shards('editable_positions')
+    reindex = held_by_shards('reindex')
+    index_rows = held_by_shards('index_rows')
+    index_row = held_by_shards('index_row')
+    
+    def __init__(self, invoices=None, shards=2, context=None):
+        """Start one worker process per shard, each indexing its part of the invoices.
+        
+        InvoiceParser.__init__ is not called: the coordinator builds no
+        indexes of its own.
+        """
+        self.invoices = get_invoices() if invoices is None else invoices
+        self._display_dates = {}
+        self.shards = shards
+        self._lock = threading.Lock()
+        self._vendor_keys = {}
+        self._vendor_key_names = []
+        self._key_of_vendor = []
+        self._key_shard = []
+        # Live invoices per vendor key, in the order the single-process
+        # parser would hold the vendor's aggregates, for breaking ties.
+        self._vendor_counts = {}
+        self._shard_vendors = [0] * shards
+        self._conns = []
+        self._workers = []
+        self.start(multiprocessing.get_context(context))
+    
+    def start(self, context):
+        """Partition the live invoices by vendor and start a worker for each shard."""
+        store = self.invoices
+        self.sync_vendor_keys()
+        rows = np.arange(len(store))
+        if store.deleted:
+            rows = rows[~store.deleted_mask[rows]]
+        key_ids = np.asarray(self._key_of_vendor, dtype=np.int64)[store.vendor_id[rows]]
+        shard_ids = np.asarray(self._key_shard, dtype=np.int64)[key_ids]
+        
+        state = store.index_snapshot
+        if state is not None and state['version'] == store.version:
+            # Keep the vendor order, invoice order and names of the snapshot
+            self._vendor_counts = {key: stats['count'] for key, stats in state['vendor_stats'].items()}
+            positions = state['vendor_positions']
+            names = {key: stats['vendor'] for key, stats in state['vendor_stats'].items()}
+        else:
+            counts = np.bincount(key_ids, minlength=len(self._vendor_key_names))
+            self._vendor_counts = {self._vendor_key_names[k]: int(counts[k]) for k in np.flatnonzero(counts)}
+            positions, names = {}, {}
+        
+        for i in range(self.shards):
+            part = rows[shard_ids == i]
+            payload = dict(zip(
+                ('rows', 'invoice_numbers', 'vendor_id', 'cents', 'invoice_date', 'due_date', 'paid'),
+                self.columns(part)
+            ))
+            payload['vendors'] = self.new_vendors(i)
+            payload['positions'] = {
+                key: np.asarray(key_rows, dtype=np.int64)
+                for key, key_rows in positions.items()
+                if self._key_shard[self._vendor_keys[key]] == i
+            }
+            payload['vendor_names'] = {key: name for key, name in names.items() if self._key_shard[self._vendor_keys[key]] == i}
+            conn, child = context.Pipe()
+            worker = context.Process(target=serve_shard, args=(child, payload), daemon=True)
+            worker.start()
+            child.close()
+            self._conns.append(conn)
+            self._workers.append(worker)
+        self._indexed = len(store)
+        self._changes = len(store.changes)
+    
+    def close(self):
+        """Stop the shard worker processes."""
+        with self._lock:
+            for conn in self._conns:
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+                conn.close()
+            for worker in self._workers:
+                worker.join(timeout=5)
+            self._conns, self._workers = [], []
+    
+    def gather(self, requests):
+        """Send {shard: (method, args)} requests at once and wait for every result."""
+        with self._lock:
+            for i, request in requests.items():
+                self._conns[i].send(request)
+            results, error = {}, None
+            for i in requests:
+                try:
+                    ok, result = self._conns[i].recv()
+                except EOFError:
+                    ok, result = False, RuntimeError(f"Invoice shard {i} has stopped")
+                if ok:
+                    results[i] = result
+                elif error is None:
+                    error = result
+        if error is not None:
+            raise error
+        return results
+    
+    def call(self, shard, method, *args):
+        return self.gather({shard: (method, args)})[shard]
+    
+    def call_all(self, method, *args):
+        results = self.gather({i: (method, args) for i in range(self.shards)})
+        return [results[i] for i in range(self.shards)]
+    
+    def sync_vendor_keys(self):
+        """Map new vendor ids to casefolded keys and each new key to its shard."""
+        super().sync_vendor_keys()
+        self._key_shard.extend(shard_of(key, self.shards) for key in self._vendor_key_names[len(self._key_shard):])
+    
+    def new_vendors(self, shard):
+        """Vendor names a shard has not been sent yet."""
+        vendors = self.invoices.vendors[self._shard_vendors[shard]:]
+        self._shard_vendors[shard] = len(self.invoices.vendors)
+        return vendors
+    
+    def columns(self, rows):
+        """Ledger rows with the invoice number and column values of each."""
+        store = self.invoices
+        return (rows, [store.invoice_numbers[row] for row in rows.tolist()], store.vendor_id[rows],
+                store.cents[rows], store.invoice_date[rows], store.due_date[rows], store.paid[rows])
+    
+    def row_key(self, row):
+        return self._vendor_key_names[self._key_of_vendor[self.invoices.vendor_id[row]]]
+    
+    def count_vendor(self, key, n):
+        """Add n invoices to a vendor's count, dropping it at zero like its aggregates."""
+        count = self._vendor_counts.get(key, 0) + n
+        if count:
+            self._vendor_counts[key] = count
+        else:
+            del self._vendor_counts[key]
+    
+    def refresh(self):
+        """Send edits and invoices appended to the store since the last refresh to their shards."""
+        if self._changes < len(self.invoices.changes):
+            self.forward(self.invoices.changes[self._changes:])
+        start, end = self._indexed, len(self.invoices)
+        if start >= end:
+            return 0
+        store = self.invoices
+        self.sync_vendor_keys()
+        rows = np.arange(start, end)
+        if store.deleted:
+            rows = rows[~store.deleted_mask[rows]]
+        key_ids = np.asarray(self._key_of_vendor, dtype=np.int64)[store.vendor_id[rows]]
+        for k, n in zip(*np.unique(key_ids, return_counts=True)):
+            self.count_vendor(self._vendor_key_names[k], int(n))
+        
+        shard_ids = np.asarray(self._key_shard, dtype=np.int64)[key_ids]
+        self.gather({
+            int(i): ('append', (self.new_vendors(i), *self.columns(rows[shard_ids == i])))
+            for i in np.unique(shard_ids)
+        })
+        self._indexed = end
+        return end - start
+    
+    def forward(self, changes):
+        """Apply rows changed in the store, e.g. through another parser, to their shards."""
+        store = self.invoices
+        previous = {}
+        for row, values in changes:
+            # Rows not sent yet go to their shards as they are now
+            if row >= self._indexed:
+                continue
+            old = previous.pop(row, {})
+            for key, value in (values or {}).items():
+                old.setdefault(key, value)
+            previous[row] = old
+        self._changes += len(changes)
+        self.sync_vendor_keys()
+        for row, old in previous.items():
+            old_key = self._vendor_key_names[self._key_of_vendor[old.get('vendor', store.vendor_id[row])]]
+            if row in store.deleted:
+                self.call(self.shard_of_key(old_key), 'delete', row)
+                self.count_vendor(old_key, -1)
+                continue
+            new_key = self.row_key(row)
+            old_shard, new_shard = self.shard_of_key(old_key), self.shard_of_key(new_key)
+            if old_shard == new_shard:
+                invoice = store[row]
+                self.call(old_shard, 'update', self.new_vendors(old_shard), row, {key: invoice[key] for key in old})
+            else:
+                self.call(old_shard, 'delete', row)
+                self.call(new_shard, 'append', self.new_vendors(new_shard), *self.columns(np.array([row])))
+            self.count_vendor(old_key, -1)
+            self.count_vendor(new_key, 1)
+    
+    def update_invoice(self, row, **changes):
+        """Change fields of an invoice, moving it to another shard if its vendor moved."""
+        self.refresh()
+        row = self.invoices.check_row(row)
+        before = dict(self.invoices[row])
+        old_key = self.row_key(row)
+        # The store validates every value before changing any
+        self.invoices.update(row, changes)
+        self.sync_vendor_keys()
+        new_key = self.row_key(row)
+        
+        old, new = self.shard_of_key(old_key), self.shard_of_key(new_key)
+        moved_out = False
+        try:
+            if old == new:
+                self.call(old, 'update', self.new_vendors(old), row, changes)
+            else:
+                self.call(old, 'delete', row)
+                moved_out = True
+                self.call(new, 'append', self.new_vendors(new), *self.columns(np.array([row])))
+        except Exception:
+            self.restore(row, before, changes)
+            if moved_out:
+                # Give the invoice back to its old shard as it was
+                self.call(old, 'append', self.new_vendors(old), *self.columns(np.array([row])))
+            raise
+        finally:
+            self._changes = len(self.invoices.changes)
+        self.count_vendor(old_key, -1)
+        self.count_vendor(new_key, 1)
+    
+    def restore(self, row, before, changes):
+        """Put back the fields of an invoice whose update a shard failed to apply."""
+        self.invoices.update(row, {key: before[key] for key in changes if key in before})
+        extras = self.invoices.extras.get(row, {})
+        for key in changes:
+            if key not in before:
+                extras.pop(key, None)
+    
+    def delete_invoice(self, row):
+        """Delete an invoice from its shard and the store."""
+        self.refresh()
+        row = self.invoices.check_row(row)
+        key = self.row_key(row)
+        self.call(self.shard_of_key(key), 'delete', row)
+        self.invoices.delete(row)
+        self._changes = len(self.invoices.changes)
+        self.count_vendor(key, -1)
+    
+    def shard_of_key(self, key):
+        return self._key_shard[self._vendor_keys[key]]
+    
+    def select(self, index, start=None, stop=None):
+        """Rows with start <= key < stop on every shard, merged in (key, row) order."""
+        rows = np.concatenate(self.call_all('select', index, start, stop))
+        keys = getattr(self.invoices, INDEX_COLUMNS[index])[rows]
+        return rows[np.lexsort((rows, keys))]
+    
+    def vendor_stats(self):
+        """Aggregates in cents of every vendor, in the single-process parser's order."""
+        merged = {}
+        for stats in self.call_all('vendor_stats'):
+            merged.update(stats)
+        return [merged[key] for key in self._vendor_counts]
+    
+    def ledger_stats(self):
+        """Aggregates in cents across all shards."""
+        total = new_stats()
+        for stats in self.call_all('summary'):
+            add_stats(total, stats['count'], stats['total'], stats['open_count'], stats['open_balance'])
+        return total
+    
+    @timed('query')
+    @fresh
+    def get_due_rows(self, start, end):
+        """Get row positions of invoices due within [start, end], in due date order."""
+        return self.select('due', to_day(start), to_day(end) + 1)
+    
+    @timed('query')
+    @fresh
+    def get_invoice_by_vendor(self, vendor_name):
+        """Get invoice by vendor name (case insensitive)."""
+        key = vendor_key(vendor_name)
+        if key not in self._vendor_counts:
+            return None
+        rows = self.call(self.shard_of_key(key), 'vendor_rows', key, 1)
+        return self.invoices[int(rows[0])] if len(rows) else None
+    
+    @timed('query')
+    @fresh
+    def find_vendor(self, phrase):
+        """Find the longest leading run of words in a phrase that names a known vendor."""
+        words = phrase.split()
+        for n in range(len(words), 0, -1):
+            name = " ".join(words[:n])
+            if vendor_key(name) in self._vendor_counts:
+                return name
+        return words[0] if words else phrase
+    
+    @timed('query')
+    @fresh
+    def get_invoices_by_vendor(self, vendor_name):
+        """Get all invoices from a vendor (case insensitive)."""
+        key = vendor_key(vendor_name)
+        if key not in self._vendor_counts:
+            return []
+        return self.invoices.rows(self.call(self.shard_of_key(key), 'vendor_rows', key))
+    
+    @timed('query')
+    @fresh
+    def get_vendor_summary(self, vendor_name):
+        """Get invoice count, total, open count and open balance for a vendor."""
+        key = vendor_key(vendor_name)
+        if key not in self._vendor_counts:
+            return None
+        stats = self.call(self.shard_of_key(key), 'vendor_stats', [key]).get(key)
+        return in_dollars(stats) if stats else None
+    
+    @timed('query')
+    @fresh
+    def get_ledger_summary(self):
+        """Get invoice count, total, open count and open balance across all vendors."""
+        return in_dollars(self.ledger_stats())
+    
+    @timed('query')
+    @fresh
+    def get_vendor_totals(self):
+        """Get the summed invoice total for every vendor."""
+        return {stats['vendor']: stats['total'] / 100 for stats in self.vendor_stats()}
+    
+    @timed('query')
+    @fresh
+    def get_rows_above_amount(self, amount):
+        """Get row positions of invoices with total above specified amount, in row order."""
+        return np.sort(np.concatenate(self.call_all('select', 'amount', cents_above(amount), None)))
+    
+    @timed('query')
+    @fresh
+    def get_total_amount(self):
+        """Get the summed total of all invoices."""
+        return self.ledger_stats()['total'] / 100
+    
+    @timed('query')
+    @fresh
+    def get_ranked_invoices(self, field='total', n=1, largest=True, vendor_name=None):
+        """Get the n invoices with the largest or smallest total, due date or invoice date.
+        
+        Each shard sends its own n candidates, which the coordinator
+        ranks; a vendor's ranking is made entirely on its shard.
+        """
+        if vendor_name is not None:
+            key = vendor_key(vendor_name)
+            if key not in self._vendor_counts:
+                return []
+            return self.invoices.rows(self.call(self.shard_of_key(key), 'ranked_vendor_rows', key, field, n, largest))
+        
+        index = RANK_INDEXES[field]
+        rows = np.concatenate(self.call_all('extreme', index, n, largest))
+        keys = getattr(self.invoices, INDEX_COLUMNS[index])[rows]
+        if keys.dtype.kind == 'M':
+            keys = keys.view(np.int64)
+        order = np.lexsort((rows, -keys if largest else keys))
+        return self.invoices.rows(rows[order[:n]])
+    
+    @timed('query')
+    @fresh
+    def get_ranked_vendors(self, by='total', n=1, largest=True):
+        """Get summaries of the n vendors with the largest or smallest total, open balance or count."""
+        pick = heapq.nlargest if largest else heapq.nsmallest
+        return [in_dollars(stats) for stats in pick(n, self.vendor_stats(), key=lambda stats: stats[by])]
+    
+    @fresh
+    def due_bucket_stats(self, period):
+        """Day -> aggregates in cents for each due-date bucket, summed across shards."""
+        merged = {}
+        for buckets in self.call_all('due_buckets', period):
+            for day, stats in buckets.items():
+                add_stats(merged.setdefault(day, new_stats()), stats['count'], stats['total'],
+                          stats['open_count'], stats['open_balance'])
+        return merged
+    
+    @timed('query')
+    @fresh
+    def get_overdue_rows(self):
+        """Get row positions of unpaid invoices past their due date, in due date order."""
+        today = datetime.now().date()
+        return self.select('open_due', stop=to_day(today))
+
+
+def make_parser(invoices=None, shards=None):
+    """An InvoiceParser, sharded across processes if shards (default INVOICE_SHARDS) is above one."""
+    if shards is None:
+        shards = int(os.environ.get('INVOICE_SHARDS') or 1)
+    if shards > 1:
+        return ShardedInvoiceParser(invoices, shards)
+    return InvoiceParser(invoices)
\ No newline at end of file
@@ -0,0 +1,271 @@
+"""
+Memory-mapped binary snapshots of an invoice store and its parser indexes.
+
+A snapshot holds the store columns, the invoice numbers, the sorted
+date and amount orderings, the vendor dictionary and the aggregates, each
+array aligned so it can be used in place. Opening one maps the file
+copy-on-write and wraps the arrays without reading or copying them, so a
+restarted or freshly started worker is query-ready in milliseconds and
+every process shares the same pages through the OS page cache.
+
+The header records a format version, a CRC32 of the payload and a
+fingerprint of the source data; a snapshot that fails any check is
+ignored and rebuilt. The checksum is verified once, when a snapshot is
+built, since checking it on every open would read the whole file.
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from datetime import date
+import numpy as np
+from invoice_store import InvoiceStore
+
+
+MAGIC = b'INVSNAP\0'
+FORMAT_VERSION = 1
+PREAMBLE = struct.Struct('<8sIII')
+ALIGN = 64
+
+COLUMNS = ('vendor_id', 'cents', 'invoice_date', 'due_date', 'paid')
+INDEXES = ('due', 'open_due', 'issued', 'amount')
+
+
+class PackedStrings:
+    def __init__(self, offsets, data):
+        """List-like view of strings stored as UTF-8 bytes between offsets."""
+        self.offsets = offsets
+        self.data = data
+        # Edits and appends are kept in Python; the packed part is read-only.
+        self.changed = {}
+        self.appended = []
+    
+    def __len__(self):
+        return len(self.offsets) - 1 + len(self.appended)
+    
+    def index(self, i):
+        """Position i counted from the end if negative, raising IndexError if out of range."""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("string index out of range")
+        return i
+    
+    def __getitem__(self, i):
+        i = self.index(i)
+        base = len(self.offsets) - 1
+        if i >= base:
+            return self.appended[i - base]
+        text = self.changed.get(i)
+        if text is None:
+            text = bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+        return text
+    
+    def __setitem__(self, i, text):
+        i = self.index(i)
+        base = len(self.offsets) - 1
+        if i >= base:
+            self.appended[i - base] = text
+        else:
+            self.changed[i] = text
+    
+    def append(self, text):
+        self.appended.append(text)
+    
+    def extend(self, texts):
+        self.appended.extend(texts)
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def fingerprint_file(path):
+    """Fingerprint a source file by its path, size and modification time."""
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def fingerprint_data(data):
+    """Fingerprint in-memory source data that can be serialized as JSON."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def pack_strings(texts):
+    """Pack strings into (offsets, data) arrays."""
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def write_snapshot(parser, path, fingerprint):
+    """Write a parser's store and indexes to path, replacing it atomically."""
+    store = parser.invoices
+    state = parser.index_state()
+    arrays = {name: getattr(store, name) for name in COLUMNS}
+    arrays['number_offsets'], arrays['number_data'] = pack_strings(store.invoice_numbers[row] for row in range(len(store)))
+    for name in INDEXES:
+        arrays[f'{name}.keys'], arrays[f'{name}.rows'] = state['indexes'][name]
+    
+    vendor_keys = state['vendor_key_names']
+    positions = [state['vendor_positions'].get(key, np.empty(0, dtype=np.int64)) for key in vendor_keys]
+    arrays['vendor_rows'] = np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+    arrays['vendor_offsets'] = np.concatenate([[0], np.cumsum([len(p) for p in positions], dtype=np.int64)])
+    
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        array = arrays[name] = np.ascontiguousarray(array)
+        layout[name] = [offset, array.dtype.str, len(array)]
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    
+    header = json.dumps({
+        'fingerprint': fingerprint,
+        'created': time.time(),
+        'size': len(store),
+        'arrays': layout,
+        'vendors': list(store.vendors),
+        'deleted': sorted(store.deleted),
+        'extras': {str(row): extra for row, extra in store.extras.items()},
+        'summary': state['summary'],
+        'due_buckets': {
+            period: {day.isoformat(): stats for day, stats in buckets.items()}
+            for period, buckets in state['due_buckets'].items()
+        },
+        'vendor_key_names': vendor_keys,
+        'key_of_vendor': state['key_of_vendor'],
+        'vendor_stats': state['vendor_stats']
+    }, default=str).encode('utf-8')
+    header += b' ' * (-(PREAMBLE.size + len(header)) % ALIGN)
+    
+    checksum = 0
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header), 0))
+        f.write(header)
+        for name, array in arrays.items():
+            data = array.view(np.uint8).reshape(-1) if array.nbytes else b''
+            padding = b'\0' * (-array.nbytes % ALIGN)
+            checksum = zlib.crc32(padding, zlib.crc32(data, checksum))
+            f.write(data)
+            f.write(padding)
+        # The checksum is written last, so a partly written file never passes
+        f.seek(0)
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header), checksum))
+    os.replace(tmp, path)
+
+
+def load_snapshot(path, fingerprint=None, verify=False):
+    """Open a snapshot as a store whose parser indexes are restored, not rebuilt.
+
+    Raises SnapshotError if the file is not a valid snapshot of the current
+    format, is too short for its arrays, was built from different source
+    data or, with verify, fails its checksum.
+    """
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except ValueError:
+            raise SnapshotError(f"{path} is empty")
+    if len(mm) < PREAMBLE.size:
+        raise SnapshotError(f"{path} is truncated")
+    magic, version, header_size, checksum = PREAMBLE.unpack_from(mm)
+    if magic != MAGIC:
+        raise SnapshotError(f"{path} is not an invoice snapshot")
+    if version != FORMAT_VERSION:
+        raise SnapshotError(f"{path} has format version {version}, expected {FORMAT_VERSION}")
+    try:
+        header = json.loads(bytes(mm[PREAMBLE.size:PREAMBLE.size + header_size]))
+    except ValueError:
+        raise SnapshotError(f"{path} has a corrupt header")
+    if fingerprint is not None and header['fingerprint'] != fingerprint:
+        raise SnapshotError(f"{path} was built from different source data")
+    
+    payload = PREAMBLE.size + header_size
+    end = max((offset + length * np.dtype(dtype).itemsize for offset, dtype, length in header['arrays'].values()), default=0)
+    if len(mm) < payload + end:
+        raise SnapshotError(f"{path} is truncated")
+    if verify and zlib.crc32(memoryview(mm)[payload:]) != checksum:
+        raise SnapshotError(f"{path} failed its checksum")
+    
+    def array(name):
+        offset, dtype, length = header['arrays'][name]
+        if not length:
+            return np.empty(0, dtype=np.dtype(dtype))
+        return np.frombuffer(mm, dtype=np.dtype(dtype), count=length, offset=payload + offset)
+    
+    store = InvoiceStore.from_arrays(
+        header['vendors'],
+        PackedStrings(array('number_offsets'), memoryview(mm)[payload + header['arrays']['number_data'][0]:]),
+        *(array(name) for name in COLUMNS),
+        extras={int(row): extra for row, extra in header['extras'].items()},
+        deleted=header['deleted']
+    )
+    
+    vendor_rows, vendor_offsets = array('vendor_rows'), array('vendor_offsets')
+    store.index_snapshot = {
+        'version': store.version,
+        'indexes': {name: (array(f'{name}.keys'), array(f'{name}.rows')) for name in INDEXES},
+        'summary': header['summary'],
+        'due_buckets': {
+            period: {date.fromisoformat(day): stats for day, stats in buckets.items()}
+            for period, buckets in header['due_buckets'].items()
+        },
+        'vendor_key_names': header['vendor_key_names'],
+        'key_of_vendor': header['key_of_vendor'],
+        'vendor_stats': header['vendor_stats'],
+        'vendor_positions': {
+            key: vendor_rows[vendor_offsets[k]:vendor_offsets[k + 1]]
+            for k, key in enumerate(header['vendor_key_names'])
+            if vendor_offsets[k + 1] > vendor_offsets[k]
+        }
+    }
+    return store
+
+
+def open_or_build(path, fingerprint, build):
+    """Load the snapshot at path, or call build() for a store and snapshot it first."""
+    if os.path.exists(path):
+        try:
+            return load_snapshot(path, fingerprint)
+        except SnapshotError as e:
+            print(f"⚠️ Rebuilding invoice snapshot: {e}")
+    
+    from invoice_parser import InvoiceParser
+    write_snapshot(InvoiceParser(build()), path, fingerprint)
+    return load_snapshot(path, fingerprint, verify=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a memory-mapped snapshot of an invoice export.")
+    parser.add_argument('input', help="JSONL or CSV invoice export")
+    parser.add_argument('output', help="snapshot file to write")
+    args = parser.parse_args()
+    
+    from invoice_loader import InvoiceFileLoader
+    from invoice_parser import InvoiceParser
+    
+    start = time.perf_counter()
+    store = InvoiceStore()
+    for chunk in InvoiceFileLoader(args.input).read_chunks():
+        store.extend(chunk)
+    invoice_parser = InvoiceParser(store)
+    write_snapshot(invoice_parser, args.output, fingerprint_file(args.input))
+    load_snapshot(args.output, verify=True)
+    built = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    InvoiceParser(load_snapshot(args.output))
+    loaded = time.perf_counter() - start
+    print(f"✅ Snapshot of {len(store):,} invoices written to {args.output} in {built:.2f}s; "
+          f"loads in {loaded * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,351 @@
+"""
+Columnar invoice storage backed by NumPy arrays.
+"""
+
+import sys
+from collections.abc import Mapping, Sequence
+from datetime import date, datetime
+import numpy as np
+from dateutil.parser import parse
+
+
+FIELDS = ('vendor', 'invoice_number', 'invoice_date', 'due_date', 'total', 'paid')
+
+
+def to_days(values):
+    """Convert date strings or date objects to a datetime64[D] array."""
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'M':
+        return values.astype('datetime64[D]')
+    values = list(values)
+    try:
+        return np.array(values, dtype='datetime64[D]')
+    except ValueError:
+        # Fall back to dateutil for formats NumPy does not understand.
+        return np.array([
+            v.date() if isinstance(v, datetime) else v if isinstance(v, date) else parse(v).date()
+            for v in values
+        ], dtype='datetime64[D]')
+
+
+def to_cents(values):
+    """Convert dollar amounts to an int64 array of cents."""
+    return np.rint(np.asarray(values, dtype=np.float64) * 100).astype(np.int64)
+
+
+class InvoiceView(Mapping):
+    __slots__ = ('_store', '_row')
+    
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+    
+    def __getitem__(self, key):
+        store, row = self._store, self._row
+        if key == 'vendor':
+            return store.vendors[store.vendor_id[row]]
+        if key == 'invoice_number':
+            return store.invoice_numbers[row]
+        if key == 'invoice_date':
+            return str(store.invoice_date[row])
+        if key == 'due_date':
+            return str(store.due_date[row])
+        if key == 'total':
+            return int(store.cents[row]) / 100
+        if key == 'paid':
+            return bool(store.paid[row])
+        extra = store.extras.get(row)
+        if extra is not None and key in extra:
+            return extra[key]
+        raise KeyError(key)
+    
+    def __iter__(self):
+        yield from FIELDS
+        yield from self._store.extras.get(self._row, ())
+    
+    def __len__(self):
+        return len(FIELDS) + len(self._store.extras.get(self._row, ()))
+    
+    def __repr__(self):
+        return repr(dict(self))
+    
+    @property
+    def row(self):
+        """Position of this invoice in the store."""
+        return self._row
+    
+    @property
+    def cents(self):
+        """Invoice total in integer cents."""
+        return int(self._store.cents[self._row])
+    
+    @property
+    def due(self):
+        """Due date as a date object."""
+        return self._store.due_date[self._row].item()
+    
+    @property
+    def issued(self):
+        """Invoice date as a date object."""
+        return self._store.invoice_date[self._row].item()
+
+
+class LiveRows(Sequence):
+    def __init__(self, store):
+        """Row positions of a store's live invoices, in row order, found a slice at a time.
+        
+        The k-th live row is k plus the number of deleted rows before it,
+        a binary search over the sorted deleted rows, so a page costs the
+        same however many invoices the store holds.
+        """
+        self._size = len(store)
+        self._deleted = np.sort(np.fromiter(store.deleted, dtype=np.int64, count=len(store.deleted)))
+        # Live rows before each deleted row
+        self._live_before = self._deleted - np.arange(len(self._deleted))
+    
+    def __len__(self):
+        return self._size - len(self._deleted)
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            k = range(len(self))[i]
+            k = np.arange(k.start, k.stop, k.step, dtype=np.int64)
+            return k + np.searchsorted(self._live_before, k, side='right')
+        k = range(len(self))[i]
+        return int(k + np.searchsorted(self._live_before, k, side='right'))
+    
+    def rank(self, row):
+        """Number of live rows at or before a row position."""
+        live = row + 1 - np.searchsorted(self._deleted, row, side='right')
+        return int(min(max(live, 0), len(self)))
+
+
+class InvoiceStore:
+    def __init__(self, invoices=()):
+        """Initialize an empty store and load any given invoice dicts."""
+        self.vendors = []
+        self.vendor_ids = {}
+        self.invoice_numbers = []
+        self.extras = {}
+        # Deleted invoices keep their row position, so row numbers held by
+        # indexes stay valid; len() counts them and iteration skips them.
+        self.deleted = set()
+        # Bumped on every change so derived caches know when to rebuild.
+        self.version = 0
+        # (row, previous values of the changed columns) for every update
+        # and (row, None) for every delete, so caches that index rows can
+        # redo just the rows that changed.
+        self.changes = []
+        # Parser index arrays loaded alongside the columns from a snapshot,
+        # valid while version is unchanged.
+        self.index_snapshot = None
+        self._size = 0
+        self._vendor_id = np.empty(0, dtype=np.int32)
+        # Money is kept in integer cents so sums are exact
+        self._cents = np.empty(0, dtype=np.int64)
+        self._invoice_date = np.empty(0, dtype='datetime64[D]')
+        self._due_date = np.empty(0, dtype='datetime64[D]')
+        self._paid = np.empty(0, dtype=np.bool_)
+        # The deleted set as a column, for vectorized filtering
+        self._deleted_mask = np.empty(0, dtype=np.bool_)
+        self.extend(invoices)
+    
+    @classmethod
+    def from_arrays(cls, vendors, invoice_numbers, vendor_id, cents, invoice_date, due_date, paid,
+                    extras=None, deleted=()):
+        """Wrap existing column arrays, such as memory-mapped ones, without copying them."""
+        store = cls()
+        for name in vendors:
+            store.encode_vendor(name)
+        store.invoice_numbers = invoice_numbers
+        store.extras = extras or {}
+        store.deleted = set(deleted)
+        store._vendor_id = vendor_id
+        store._cents = cents
+        store._invoice_date = invoice_date
+        store._due_date = due_date
+        store._paid = paid
+        store._deleted_mask = np.zeros(len(vendor_id), dtype=np.bool_)
+        store._deleted_mask[list(store.deleted)] = True
+        store._size = len(vendor_id)
+        store.version = 1
+        return store
+    
+    # Columns are exposed trimmed to the live size; the backing arrays keep
+    # spare capacity so appends are amortized O(1) per invoice.
+    @property
+    def vendor_id(self):
+        return self._vendor_id[:self._size]
+    
+    @property
+    def cents(self):
+        return self._cents[:self._size]
+    
+    @property
+    def total(self):
+        """Totals in dollars, computed from the cents column."""
+        return self.cents / 100
+    
+    @property
+    def invoice_date(self):
+        return self._invoice_date[:self._size]
+    
+    @property
+    def due_date(self):
+        return self._due_date[:self._size]
+    
+    @property
+    def paid(self):
+        return self._paid[:self._size]
+    
+    @property
+    def deleted_mask(self):
+        return self._deleted_mask[:self._size]
+    
+    def encode_vendor(self, name):
+        """Return the integer id for a vendor name, adding it if new."""
+        vendor_id = self.vendor_ids.get(name)
+        if vendor_id is None:
+            name = sys.intern(name)
+            vendor_id = self.vendor_ids[name] = len(self.vendors)
+            self.vendors.append(name)
+        return vendor_id
+    
+    def reserve(self, capacity):
+        """Grow the backing arrays to hold at least capacity invoices."""
+        if capacity <= len(self._cents):
+            return
+        capacity = max(capacity, 2 * len(self._cents), 16)
+        for attr in ('_vendor_id', '_cents', '_invoice_date', '_due_date', '_paid', '_deleted_mask'):
+            old = getattr(self, attr)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, attr, new)
+    
+    def extend(self, invoices):
+        """Append invoice dicts and return the range of new row positions."""
+        invoices = list(invoices)
+        start, end = self._size, self._size + len(invoices)
+        self.reserve(end)
+        
+        for row, inv in enumerate(invoices, start):
+            self._vendor_id[row] = self.encode_vendor(inv['vendor'])
+            self.invoice_numbers.append(inv['invoice_number'])
+            extra = {k: v for k, v in inv.items() if k not in FIELDS}
+            if extra:
+                self.extras[row] = extra
+        
+        self._cents[start:end] = to_cents([inv['total'] for inv in invoices])
+        self._invoice_date[start:end] = to_days(inv['invoice_date'] for inv in invoices)
+        self._due_date[start:end] = to_days(inv['due_date'] for inv in invoices)
+        self._paid[start:end] = [bool(inv.get('paid', False)) for inv in invoices]
+        self._deleted_mask[start:end] = False
+        self._size = end
+        if invoices:
+            self.version += 1
+        return range(start, end)
+    
+    def extend_columns(self, vendor, invoice_number, invoice_date, due_date, total, paid=None):
+        """Append invoices given as equal-length columns and return the new row positions."""
+        names, inverse = np.unique(np.asarray(vendor), return_inverse=True)
+        vendor_id = np.array([self.encode_vendor(str(name)) for name in names], dtype=np.int32)[inverse]
+        start, end = self._size, self._size + len(vendor_id)
+        self.reserve(end)
+        
+        self._vendor_id[start:end] = vendor_id
+        self.invoice_numbers.extend(str(number) for number in invoice_number)
+        self._cents[start:end] = to_cents(total)
+        self._invoice_date[start:end] = to_days(invoice_date)
+        self._due_date[start:end] = to_days(due_date)
+        self._paid[start:end] = False if paid is None else paid
+        self._deleted_mask[start:end] = False
+        self._size = end
+        if end > start:
+            self.version += 1
+        return range(start, end)
+    
+    def append(self, invoice):
+        """Append a single invoice dict and return its row position."""
+        return self.extend([invoice])[0]
+    
+    def check_row(self, row):
+        """Return a row position, raising IndexError if it is out of range or deleted."""
+        if row < 0:
+            row += self._size
+        if not 0 <= row < self._size:
+            raise IndexError("invoice index out of range")
+        if row in self.deleted:
+            raise IndexError(f"invoice {row} has been deleted")
+        return row
+    
+    def convert(self, changes):
+        """Column values for a dict of field changes, raising if any value is invalid."""
+        values = {}
+        for key, value in changes.items():
+            if key in ('invoice_date', 'due_date'):
+                value = to_days([value])[0]
+            elif key == 'total':
+                value = round(value * 100)
+            elif key == 'paid':
+                value = bool(value)
+            values[key] = value
+        if 'vendor' in values:
+            values['vendor'] = self.encode_vendor(values['vendor'])
+        return values
+    
+    def update(self, row, changes):
+        """Change fields of an invoice in place, all of them or, if a value is invalid, none."""
+        row = self.check_row(row)
+        # Every value is converted before any is written
+        values = self.convert(changes)
+        previous = {}
+        for key, value in values.items():
+            if key == 'vendor':
+                previous[key] = self._vendor_id[row]
+                self._vendor_id[row] = value
+            elif key == 'invoice_number':
+                previous[key] = self.invoice_numbers[row]
+                self.invoice_numbers[row] = value
+            elif key in ('invoice_date', 'due_date'):
+                column = getattr(self, f'_{key}')
+                previous[key] = column[row]
+                column[row] = value
+            elif key == 'total':
+                previous[key] = self._cents[row]
+                self._cents[row] = value
+            elif key == 'paid':
+                previous[key] = self._paid[row]
+                self._paid[row] = value
+            else:
+                self.extras.setdefault(row, {})[key] = value
+        self.changes.append((row, previous))
+        self.version += 1
+    
+    def delete(self, row):
+        """Delete an invoice, leaving its row position unused."""
+        row = self.check_row(row)
+        self.deleted.add(row)
+        self._deleted_mask[row] = True
+        self.changes.append((row, None))
+        self.version += 1
+    
+    def live_rows(self):
+        """Row positions of the invoices that have not been deleted."""
+        if not self.deleted:
+            return range(self._size)
+        return np.flatnonzero(~self.deleted_mask)
+    
+    def rows(self, positions):
+        """Return dict-style views for the given row positions."""
+        return [InvoiceView(self, int(i)) for i in positions]
+    
+    def __len__(self):
+        return self._size
+    
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return self.rows(range(self._size)[row])
+        return InvoiceView(self, self.check_row(row))
+    
+    def __iter__(self):
+        for row in self.live_rows():
+            yield InvoiceView(self, int(row))
\ No newline at end of file
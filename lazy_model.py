@@ -0,0 +1,44 @@
+"""
+Deferred model loading with optional background warm-up.
+"""
+
+import threading
+
+
+class LazyModel:
+    def __init__(self, loader):
+        """Wrap a loader callable that returns a model or None on failure."""
+        self.loader = loader
+        self.model = None
+        self.attempted = False
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def get(self):
+        """Return the model, loading it on first use."""
+        if self.attempted:
+            return self.model
+        # Callers arriving while a warm-up is in flight wait for it here
+        # instead of loading the weights a second time.
+        with self._lock:
+            if not self.attempted:
+                self.model = self.loader()
+                self.attempted = True
+                # The loader may hold on to whoever created this model
+                self.loader = None
+        return self.model
+    
+    def warm_up(self):
+        """Start loading the model on a background thread."""
+        if self._thread is None and not self.attempted:
+            self._thread = threading.Thread(target=self.get, name="model-warm-up", daemon=True)
+            self._thread.start()
+        return self._thread
+    
+    def is_loading(self):
+        """Check if a load is currently in progress."""
+        return self._lock.locked()
+    
+    def is_loaded(self):
+        """Check if the model has been loaded successfully."""
+        return self.attempted and self.model is not None
\ No newline at end of file
@@ -2,91 +2,308 @@
 Local LLM handler using Hugging Face transformers.
 """
 
+import copy
 import json
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
-import torch
+import threading
+from collections import OrderedDict
+from cpu_inference import InferenceOptions, optimize_model
 from invoice_data import get_invoices
+from invoice_retrieval import retriever_for
+from metrics import timed, timer
+from model_registry import models
+from response_cache import TransientResponse
+
+
+PROMPT_HEADER = """You are an invoice assistant. Based on the following invoice data, answer the user's question concisely.
+
+Available invoice data:
+"""
+
+
+class StopAtLineEnd:
+    def __init__(self, tokenizer, prompt_length, newline_ids):
+        """Stopping criterion that ends generation once the answer's first line is complete."""
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.newline_ids = newline_ids
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        
+        done = []
+        for ids in input_ids[:, self.prompt_length:].tolist():
+            # Leading blank lines are stripped from the answer, so a newline
+            # only ends it once some text precedes it.
+            done.append(bool(ids) and ids[-1] in self.newline_ids and
+                        '\n' in self.tokenizer.decode(ids, skip_special_tokens=True).lstrip())
+        return torch.tensor(done, device=input_ids.device)
 
 
 class LocalLLMHandler:
-    def __init__(self, model_name="microsoft/DialoGPT-small"):
-        """Initialize the local LLM handler."""
+    def __init__(self, model_name="microsoft/DialoGPT-small", warm_up=False, context_size=8, invoices=None,
+                 inference=None, prefix_cache_size=4):
+        """Initialize the local LLM handler; the model loads on first use."""
         self.model_name = model_name
         self.tokenizer = None
         self.model = None
-        self.pipeline = None
-        self.invoices = get_invoices()
-        self.load_model()
+        self.inference = inference or InferenceOptions.from_env()
+        # Handlers with the same model and options share one loaded copy
+        self.model_key = ('text-generation', model_name, self.inference.key())
+        self.lazy_pipeline = models.acquire(self.model_key, self.load_model)
+        self._released = False
+        self.invoices = get_invoices() if invoices is None else invoices
+        self.context_size = context_size
+        self.retriever = retriever_for(self.invoices)
+        self._lines = {}
+        self._line_ids = {}
+        self._header_ids = None
+        self._cache_version = None
+        # Past key/values of prompt prefixes, keyed by the invoice rows they
+        # contain; each entry holds the attention state for a few hundred tokens
+        self.prefix_cache_size = prefix_cache_size
+        self._header_state = None
+        self._prefix_states = OrderedDict()
+        self._prefix_lock = threading.Lock()
+        self._newline_ids = None
+        if warm_up:
+            self.lazy_pipeline.warm_up()
+    
+    @property
+    def pipeline(self):
+        """The text generation pipeline, loaded on first access."""
+        return self.lazy_pipeline.get()
     
     def load_model(self):
         """Load the local model."""
         try:
+            # Heavy imports are deferred so rule-based use never pays for them.
+            import torch
+            from transformers import pipeline
+            
             print(f"Loading local model: {self.model_name}...")
             
             # Use a lightweight text generation model
-            self.pipeline = pipeline(
+            text_pipeline = pipeline(
                 "text-generation",
-                model="microsoft/DialoGPT-small",
-                tokenizer="microsoft/DialoGPT-small",
+                model=self.model_name,
+                tokenizer=self.model_name,
                 device=0 if torch.cuda.is_available() else -1,
                 max_length=200,
                 do_sample=True,
                 temperature=0.7
             )
+            example = text_pipeline.tokenizer(self.create_context_prompt("Which invoice is due next?"), return_tensors='pt')
+            text_pipeline.model = optimize_model(text_pipeline.model, self.inference, example, supports_torchscript=False)
             
             print("✅ Local model loaded successfully!")
+            return text_pipeline
             
         except Exception as e:
             print(f"⚠️ Could not load model: {e}")
             print("Falling back to rule-based responses only.")
-            self.pipeline = None
+            return None
+    
+    def close(self):
+        """Release this handler's hold on the shared model."""
+        if not self._released:
+            self._released = True
+            models.release(self.model_key)
     
+    def sync_prompt_cache(self):
+        """Drop cached prompt lines and token ids if the invoices changed."""
+        if self._cache_version != self.invoices.version:
+            self._lines = {}
+            self._line_ids = {}
+            with self._prefix_lock:
+                self._prefix_states.clear()
+            self._cache_version = self.invoices.version
+    
+    def invoice_line(self, row):
+        """Describe one invoice for the prompt, cached per data version."""
+        line = self._lines.get(row)
+        if line is None:
+            inv = self.invoices[row]
+            line = self._lines[row] = (
+                f"- {inv['vendor']}: Invoice #{inv['invoice_number']}, "
+                f"Date: {inv['invoice_date']}, Due: {inv['due_date']}, "
+                f"Total: ${inv['total']:.2f}\n"
+            )
+        return line
+    
+    @timed('context')
+    def context_rows(self, query):
+        """Pick the invoices to include in the prompt for a query."""
+        return self.retriever.search(query, self.context_size)
+    
+    @timed('context')
     def create_context_prompt(self, query):
-        """Create a context-aware prompt with invoice data."""
-        invoice_context = "Available invoice data:\n"
-        for inv in self.invoices:
-            invoice_context += f"- {inv['vendor']}: Invoice #{inv['invoice_number']}, "
-            invoice_context += f"Date: {inv['invoice_date']}, Due: {inv['due_date']}, "
-            invoice_context += f"Total: ${inv['total']:.2f}\n"
+        """Create a context-aware prompt with the invoices relevant to the query."""
+        self.sync_prompt_cache()
+        invoice_lines = "".join(self.invoice_line(row) for row in self.context_rows(query))
+        return f"{PROMPT_HEADER}{invoice_lines}\n\nUser question: {query}\nAssistant: "
+    
+    @timed('tokenize')
+    def encode_prompt(self, query, tokenizer):
+        """Tokenize the prompt, reusing cached token ids for everything but the question."""
+        self.sync_prompt_cache()
+        if self._header_ids is None:
+            self._header_ids = tokenizer(PROMPT_HEADER)['input_ids']
         
-        prompt = f"""You are an invoice assistant. Based on the following invoice data, answer the user's question concisely.
-
-{invoice_context}
-
-User question: {query}
-Assistant: """
+        input_ids = list(self._header_ids)
+        for row in self.context_rows(query):
+            input_ids.extend(self.line_ids(row, tokenizer))
+        input_ids.extend(self.question_ids(query, tokenizer))
+        return input_ids
+    
+    def line_ids(self, row, tokenizer):
+        """Token ids for one invoice line, cached per data version."""
+        ids = self._line_ids.get(row)
+        if ids is None:
+            ids = self._line_ids[row] = tokenizer(self.invoice_line(row))['input_ids']
+        return ids
+    
+    def question_ids(self, query, tokenizer):
+        """Token ids for the part of the prompt after the invoice data."""
+        return tokenizer(f"\n\nUser question: {query}\nAssistant: ")['input_ids']
+    
+    def prefix_state(self, rows, model, tokenizer):
+        """Get the token ids and past key/values for the prompt up to the question.
         
-        return prompt
+        The header's state is computed once; the invoice lines are run on top
+        of it and the result is kept per set of rows for the current data
+        version, so a repeated context costs no forward pass at all.
+        """
+        import torch
+        
+        self.sync_prompt_cache()
+        key = tuple(rows)
+        with self._prefix_lock:
+            state = self._prefix_states.get(key)
+            if state is not None:
+                self._prefix_states.move_to_end(key)
+                return state
+        
+        with timer('prefill'), torch.inference_mode():
+            if self._header_state is None:
+                if self._header_ids is None:
+                    self._header_ids = tokenizer(PROMPT_HEADER)['input_ids']
+                header = torch.tensor([self._header_ids], device=model.device)
+                self._header_state = model(input_ids=header, use_cache=True).past_key_values
+            
+            line_ids = [i for row in rows for i in self.line_ids(row, tokenizer)]
+            past = self._header_state
+            if line_ids:
+                lines = torch.tensor([line_ids], device=model.device)
+                past = model(input_ids=lines, past_key_values=copy.deepcopy(past), use_cache=True).past_key_values
+        
+        state = (self._header_ids + line_ids, past)
+        with self._prefix_lock:
+            self._prefix_states[key] = state
+            while len(self._prefix_states) > self.prefix_cache_size:
+                self._prefix_states.popitem(last=False)
+        return state
+    
+    def newline_ids(self, tokenizer):
+        """Ids of the tokens whose text contains a newline."""
+        if self._newline_ids is None:
+            texts = tokenizer.batch_decode([[i] for i in range(len(tokenizer))])
+            self._newline_ids = {token_id for token_id, text in enumerate(texts) if '\n' in text}
+        return self._newline_ids
+    
+    def generate(self, query, streamer=None):
+        """Run generation for a query and return the new token ids."""
+        import torch
+        from transformers import StoppingCriteriaList
+        
+        tokenizer, model = self.pipeline.tokenizer, self.pipeline.model
+        prefix_ids, past = self.prefix_state(self.context_rows(query), model, tokenizer)
+        with timer('tokenize'):
+            input_ids = torch.tensor([prefix_ids + self.question_ids(query, tokenizer)], device=model.device)
+        stop = StopAtLineEnd(tokenizer, input_ids.shape[1], self.newline_ids(tokenizer))
+        
+        # Only the question and new tokens go through the model; the
+        # prefix state is copied since generation extends it in place.
+        with timer('inference'), torch.inference_mode():
+            output = model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=copy.deepcopy(past),
+                max_new_tokens=100,
+                do_sample=True,
+                temperature=0.7,
+                pad_token_id=tokenizer.eos_token_id,
+                stopping_criteria=StoppingCriteriaList([stop]),
+                streamer=streamer
+            )
+        return output[0, input_ids.shape[1]:]
     
     def generate_response(self, query):
         """Generate response using the local LLM."""
-        if not self.pipeline:
-            return "I'm sorry, the local AI model is not available. Please try a more specific query."
+        text_pipeline = self.pipeline
+        if not text_pipeline:
+            return TransientResponse("I'm sorry, the local AI model is not available. Please try a more specific query.")
         
         try:
-            prompt = self.create_context_prompt(query)
-            
-            # Generate response
-            response = self.pipeline(
-                prompt,
-                max_new_tokens=100,
-                num_return_sequences=1,
-                pad_token_id=self.pipeline.tokenizer.eos_token_id
-            )
+            new_ids = self.generate(query)
             
             # Extract the generated text after the prompt
-            generated_text = response[0]['generated_text']
+            with timer('decode'):
+                generated_text = text_pipeline.tokenizer.decode(new_ids, skip_special_tokens=True)
             assistant_response = generated_text.split("Assistant: ")[-1].strip()
             
             # Clean up the response
             assistant_response = assistant_response.split('\n')[0]  # Take first line
             
-            return assistant_response if assistant_response else "I'm not sure how to answer that question."
+            return assistant_response if assistant_response else TransientResponse("I'm not sure how to answer that question.")
             
         except Exception as e:
             print(f"Error generating LLM response: {e}")
-            return "I encountered an error processing your question. Please try rephrasing it."
+            return TransientResponse("I encountered an error processing your question. Please try rephrasing it.")
+    
+    def stream_response(self, query):
+        """Yield the response to a query in pieces as the model generates it."""
+        text_pipeline = self.pipeline
+        if not text_pipeline:
+            yield TransientResponse("I'm sorry, the local AI model is not available. Please try a more specific query.")
+            return
+        
+        from transformers import TextIteratorStreamer
+        
+        streamer = TextIteratorStreamer(text_pipeline.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+        
+        def run():
+            try:
+                self.generate(query, streamer)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+        
+        thread = threading.Thread(target=run, name="llm-stream", daemon=True)
+        thread.start()
+        answered = False
+        for piece in streamer:
+            if not answered:
+                piece = piece.lstrip()
+            line, newline, _ = piece.partition('\n')
+            if line:
+                answered = True
+                yield line
+            if newline and answered:
+                break
+        thread.join()
+        
+        if errors:
+            print(f"Error generating LLM response: {errors[0]}")
+            # A cut-off answer is flagged so it is not cached either
+            yield TransientResponse("" if answered else "I encountered an error processing your question. Please try rephrasing it.")
+        elif not answered:
+            yield TransientResponse("I'm not sure how to answer that question.")
     
     def is_available(self):
-        """Check if the LLM is available."""
-        return self.pipeline is not None
\ No newline at end of file
+        """Check if the LLM is available, loading it if needed."""
+        return self.pipeline is not None
+    
+    def is_loaded(self):
+        """Check if the LLM has already been loaded, without loading it."""
+        return self.lazy_pipeline.is_loaded()
\ No newline at end of file
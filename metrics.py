@@ -0,0 +1,187 @@
+"""
+Per-stage timings and resolution counters for the chatbots.
+
+Metrics are off by default. Set INVOICE_METRICS=1 (or call enable()) to
+record them, and INVOICE_METRICS_FILE to a .json or .prom path to have
+flush() write them out. When disabled, timers are a shared no-op and
+counters return immediately, so instrumented code pays almost nothing.
+
+Stages can nest (a handler's time includes its parser queries), so stage
+totals are inclusive rather than additive.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from functools import wraps
+
+
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+_NO_TIMER = nullcontext()
+
+
+class StageTimer:
+    __slots__ = ('registry', 'stage', 'start')
+    
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.registry.observe(self.stage, time.perf_counter() - self.start)
+
+
+class MetricsRegistry:
+    def __init__(self, enabled=False):
+        """Initialize an empty in-process registry."""
+        self.enabled = enabled
+        self.sinks = []
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """Drop every recorded timing and counter."""
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+    
+    def timer(self, stage):
+        """Context manager that records the time spent in a stage."""
+        if not self.enabled:
+            return _NO_TIMER
+        return StageTimer(self, stage)
+    
+    def observe(self, stage, seconds):
+        """Record one timing for a stage."""
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = {'count': 0, 'total': 0.0, 'max': 0.0, 'buckets': [0] * len(BUCKETS)}
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    stats['buckets'][i] += 1
+                    break
+    
+    def count(self, name, n=1):
+        """Increment a counter."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+    
+    def snapshot(self):
+        """Return the current timings and counters as plain data."""
+        with self._lock:
+            stages = {
+                stage: {
+                    'count': stats['count'],
+                    'total_ms': round(stats['total'] * 1000, 4),
+                    'mean_ms': round(stats['total'] * 1000 / stats['count'], 4),
+                    'max_ms': round(stats['max'] * 1000, 4),
+                    'buckets': list(stats['buckets'])
+                }
+                for stage, stats in self.stages.items()
+            }
+            return {'stages': stages, 'counters': dict(self.counters)}
+    
+    def add_sink(self, sink):
+        """Register a sink that flush() writes snapshots to."""
+        self.sinks.append(sink)
+    
+    def flush(self):
+        """Write the current snapshot to every sink."""
+        if not self.enabled or not self.sinks:
+            return
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            sink.write(snapshot)
+
+
+def prometheus_text(snapshot, prefix='invoice_chatbot'):
+    """Render a snapshot in the Prometheus text exposition format."""
+    lines = [
+        f"# HELP {prefix}_stage_seconds Time spent in each processing stage.",
+        f"# TYPE {prefix}_stage_seconds histogram"
+    ]
+    for stage, stats in sorted(snapshot['stages'].items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS, stats['buckets']):
+            cumulative += n
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats["count"]}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {stats["total_ms"] / 1000}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+    
+    lines.append(f"# HELP {prefix}_events_total Query resolutions and cache lookups.")
+    lines.append(f"# TYPE {prefix}_events_total counter")
+    for name, value in sorted(snapshot['counters'].items()):
+        lines.append(f'{prefix}_events_total{{event="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+class JSONSink:
+    def __init__(self, path):
+        self.path = path
+    
+    def write(self, snapshot):
+        """Write a snapshot as JSON."""
+        with open(self.path, 'w') as f:
+            json.dump(snapshot, f, indent=2)
+
+
+class PrometheusSink:
+    def __init__(self, path):
+        self.path = path
+    
+    def write(self, snapshot):
+        """Write a snapshot in Prometheus text format, e.g. for the node exporter's textfile collector."""
+        with open(self.path, 'w') as f:
+            f.write(prometheus_text(snapshot))
+
+
+def sink_for_path(path):
+    """Pick a sink from a file extension: .prom for Prometheus, JSON otherwise."""
+    return PrometheusSink(path) if path.endswith('.prom') else JSONSink(path)
+
+
+registry = MetricsRegistry(enabled=os.environ.get('INVOICE_METRICS', '') not in ('', '0'))
+if os.environ.get('INVOICE_METRICS_FILE'):
+    registry.add_sink(sink_for_path(os.environ['INVOICE_METRICS_FILE']))
+
+
+def enable(enabled=True):
+    """Turn metrics recording on or off."""
+    registry.enabled = enabled
+
+
+def timer(stage):
+    """Time a block of code as a stage in the shared registry."""
+    return registry.timer(stage)
+
+
+def count(name, n=1):
+    """Increment a counter in the shared registry."""
+    registry.count(name, n)
+
+
+def timed(stage):
+    """Decorator that times each call to a function as a stage."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return fn(*args, **kwargs)
+            with StageTimer(registry, stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
\ No newline at end of file
@@ -0,0 +1,74 @@
+"""
+Process-wide registry of loaded models, shared between chatbot instances.
+
+Models are keyed by task, model name and inference options, so every bot
+that asks for the same model gets the same lazily loaded pipeline rather
+than loading its own copy of the weights. Holders are counted, and a
+model is dropped once its last holder releases it.
+
+preload() loads every registered model up front. Calling it before
+forking worker processes lets them share the weights copy-on-write.
+"""
+
+import gc
+import threading
+from lazy_model import LazyModel
+
+
+class ModelRegistry:
+    def __init__(self):
+        """Initialize an empty registry."""
+        # Key -> [LazyModel, number of holders]
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def acquire(self, key, loader):
+        """Return the shared LazyModel for a key, registering the loader if the key is new."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [LazyModel(loader), 0]
+            entry[1] += 1
+            return entry[0]
+    
+    def release(self, key):
+        """Drop one holder of a model; the last release unloads it."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._entries[key]
+    
+    def holders(self, key):
+        """Number of holders of a model, 0 if it is not registered."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry else 0
+    
+    def stats(self):
+        """Describe each registered model: its holders and whether it is loaded."""
+        with self._lock:
+            return [
+                {'key': list(map(str, key)), 'holders': holders, 'loaded': model.is_loaded()}
+                for key, (model, holders) in self._entries.items()
+            ]
+    
+    def preload(self, freeze=True):
+        """Load every registered model now and return how many loaded.
+        
+        With freeze, the loaded objects are moved out of the garbage
+        collector's reach so forked workers do not copy their pages just
+        by scanning them.
+        """
+        with self._lock:
+            lazy_models = [model for model, _ in self._entries.values()]
+        for model in lazy_models:
+            model.get()
+        if freeze:
+            gc.freeze()
+        return sum(model.is_loaded() for model in lazy_models)
+
+
+models = ModelRegistry()
\ No newline at end of file
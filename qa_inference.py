@@ -0,0 +1,117 @@
+"""
+Extractive Q&A over a pre-tokenized context.
+
+The Hugging Face question-answering pipeline re-tokenizes the context on
+every call. These helpers take context encodings built by the caller,
+which can cache them, so only the question is tokenized per query.
+"""
+
+import numpy as np
+from metrics import timer
+
+
+def encode_context(tokenizer, context):
+    """Tokenize a context once, keeping character offsets for answers."""
+    encoding = tokenizer(context, add_special_tokens=False, return_offsets_mapping=True)
+    return {
+        'input_ids': encoding['input_ids'],
+        'offset_mapping': encoding['offset_mapping']
+    }
+
+
+def build_features(tokenizer, questions, context_encodings, max_length=384, doc_stride=128):
+    """Pair each question with windows of its encoded context."""
+    features = []
+    
+    for qi, question in enumerate(questions):
+        context_ids = context_encodings[qi]['input_ids']
+        question_ids = tokenizer(question, add_special_tokens=False)['input_ids'][:64]
+        # Special tokens around an empty second segment tell us where the
+        # context starts and how many tokens the template adds.
+        template = tokenizer.build_inputs_with_special_tokens(question_ids, [])
+        context_start = len(template) - 1
+        window = max(max_length - len(template), 1)
+        
+        start = 0
+        while True:
+            span = context_ids[start:start + window]
+            input_ids = tokenizer.build_inputs_with_special_tokens(question_ids, span)
+            features.append((qi, start, context_start, len(span), input_ids))
+            if start + window >= len(context_ids):
+                break
+            start += max(window - doc_stride, 1)
+    
+    return features
+
+
+def best_span(start_logits, end_logits, context_start, span_length, max_answer_len=15):
+    """Pick the most likely answer span inside the context tokens."""
+    allowed = np.zeros(len(start_logits), dtype=bool)
+    allowed[0] = True
+    allowed[context_start:context_start + span_length] = True
+    
+    start = np.where(allowed, start_logits, -10000.0)
+    end = np.where(allowed, end_logits, -10000.0)
+    start = np.exp(start - start.max())
+    start /= start.sum()
+    end = np.exp(end - end.max())
+    end /= end.sum()
+    start[0] = end[0] = 0.0
+    
+    # Candidate spans must end after they start and stay under the limit.
+    scores = np.triu(np.outer(start, end))
+    scores = np.tril(scores, max_answer_len - 1)
+    s, e = np.unravel_index(np.argmax(scores), scores.shape)
+    return int(s) - context_start, int(e) - context_start, float(scores[s, e])
+
+
+def answer_questions(qa_pipeline, questions, contexts, context_encodings, batch_size=16,
+                     max_length=384, doc_stride=128, max_answer_len=15):
+    """Answer each question against its own pre-encoded context.
+
+    Returns one dict per question with the same keys as the pipeline:
+    answer, score, start and end.
+    """
+    import torch
+    
+    tokenizer, model = qa_pipeline.tokenizer, qa_pipeline.model
+    max_length = min(max_length, tokenizer.model_max_length)
+    with timer('tokenize'):
+        features = build_features(tokenizer, questions, context_encodings, max_length, doc_stride)
+    best = [None] * len(questions)
+    
+    for i in range(0, len(features), batch_size):
+        batch = features[i:i + batch_size]
+        width = max(len(f[4]) for f in batch)
+        input_ids = torch.full((len(batch), width), tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+        for row, feature in enumerate(batch):
+            input_ids[row, :len(feature[4])] = torch.tensor(feature[4])
+            attention_mask[row, :len(feature[4])] = 1
+        
+        with timer('inference'), torch.inference_mode():
+            output = model(input_ids=input_ids, attention_mask=attention_mask)
+            start_logits = output.start_logits.numpy()
+            end_logits = output.end_logits.numpy()
+        
+        with timer('decode'):
+            for row, (qi, ctx_start, context_start, span_length, ids) in enumerate(batch):
+                if not span_length:
+                    continue
+                s, e, score = best_span(
+                    start_logits[row, :len(ids)], end_logits[row, :len(ids)],
+                    context_start, span_length, max_answer_len
+                )
+                if best[qi] is None or score > best[qi]['score']:
+                    offsets = context_encodings[qi]['offset_mapping']
+                    char_start = offsets[ctx_start + s][0]
+                    char_end = offsets[ctx_start + e][1]
+                    best[qi] = {
+                        'answer': contexts[qi][char_start:char_end],
+                        'score': score,
+                        'start': char_start,
+                        'end': char_end
+                    }
+    
+    empty = {'answer': '', 'score': 0.0, 'start': 0, 'end': 0}
+    return [result or dict(empty) for result in best]
\ No newline at end of file
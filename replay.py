@@ -0,0 +1,231 @@
+"""
+Offline batch replay of logged questions.
+
+Streams a JSONL file of questions and writes a JSONL file of answers
+with timings. Rule-based questions are answered by a pool of worker
+processes that each hold the invoice indexes; questions that need the
+model are sent in batches to a single inference worker. Finished lines
+are recorded in the output, so an interrupted run can be resumed.
+
+"More" is recorded as unsupported rather than answered: questions are
+answered in parallel, so there is no previous listing it could continue.
+
+With preload, the bot, its model and its invoice index are loaded once in
+the parent and the workers are forked from it, so they share its memory
+instead of each loading their own copy.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from intent_router import dispatch, route
+from invoice_retrieval import retriever_for
+from model_registry import models
+
+
+_bot = None
+
+
+def make_bot(name):
+    """Create a chatbot by name without loading its model."""
+    if name == 'full':
+        from chatbot import InvoiceChatbot
+        return InvoiceChatbot()
+    from chatbot_simple import SimpleLLMChatbot
+    return SimpleLLMChatbot()
+
+
+def init_worker(name):
+    """Build this worker process's chatbot, unless it was inherited from a preloading parent."""
+    global _bot
+    if _bot is None:
+        _bot = make_bot(name)
+
+
+def answer_rules(chunk):
+    """Answer (line, query) pairs with the rules; unanswered ones get a None response."""
+    results = []
+    for line, query in chunk:
+        start = time.perf_counter()
+        intent, slots = route(query)
+        source = 'rule'
+        try:
+            if intent == 'exit':
+                response = "Goodbye! Thanks for using the Invoice Chatbot."
+            elif intent == 'more':
+                response, source = "'More' is not replayed: it would continue whichever listing this worker answered last.", 'unsupported'
+            else:
+                response = dispatch(_bot, intent, slots)
+        except Exception as e:
+            response, source = f"Error processing query: {e}", 'error'
+        results.append((line, query, response, source, time.perf_counter() - start))
+    return results
+
+
+def answer_model(batch):
+    """Answer a batch of (line, query) pairs with the model."""
+    start = time.perf_counter()
+    try:
+        responses = _bot.answer_model_batch([query for _, query in batch])
+        source = 'model'
+    except Exception as e:
+        responses, source = [f"Error processing with AI model: {e}"] * len(batch), 'error'
+    elapsed = (time.perf_counter() - start) / len(batch)
+    return [(line, query, response, source, elapsed) for (line, query), response in zip(batch, responses)]
+
+
+def read_questions(path, skip=()):
+    """Yield (line, query) for each question in a JSONL file, skipping finished lines."""
+    with open(path, encoding='utf-8') as f:
+        for line, text in enumerate(f, 1):
+            if line in skip or not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError:
+                record = text.strip()
+            if isinstance(record, dict):
+                query = record.get('query') or record.get('question') or ''
+            else:
+                query = str(record)
+            yield line, query
+
+
+def finished_lines(path):
+    """Line numbers already answered in an existing output file.
+    
+    A run killed mid-write can leave a partial last record; it is cut off
+    so new records are appended on a line of their own.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'rb+') as f:
+        complete = 0
+        for text in f:
+            if not text.endswith(b"\n"):
+                break
+            complete += len(text)
+            try:
+                done.add(json.loads(text)['line'])
+            except (ValueError, KeyError, TypeError):
+                continue
+        f.truncate(complete)
+    return done
+
+
+class BatchReplay:
+    def __init__(self, bot='simple', workers=None, chunk_size=64, batch_size=16, preload=False):
+        """Initialize a replay with a rule worker pool and one model worker."""
+        self.bot = bot
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.preload = preload
+        self.counts = {'rule': 0, 'model': 0, 'error': 0, 'unsupported': 0}
+    
+    def pool_context(self):
+        """Multiprocessing context for the worker pools, preloading the bot first if asked."""
+        global _bot
+        if not self.preload or 'fork' not in multiprocessing.get_all_start_methods():
+            return None
+        if _bot is None:
+            _bot = make_bot(self.bot)
+        # Index the invoices for model prompts too, so workers inherit it
+        retriever_for(_bot.parser.invoices).refresh()
+        loaded = models.preload()
+        print(f"✅ Preloaded {loaded} model(s) to share with forked workers")
+        return multiprocessing.get_context('fork')
+    
+    def run(self, input_path, output_path, resume=True):
+        """Answer every unfinished question in input_path, appending to output_path."""
+        done = finished_lines(output_path) if resume else set()
+        mode = 'a' if resume else 'w'
+        start = time.perf_counter()
+        context = self.pool_context()
+        
+        with open(output_path, mode, encoding='utf-8') as out, \
+                ProcessPoolExecutor(self.workers, context, initializer=init_worker, initargs=(self.bot,)) as rules, \
+                ProcessPoolExecutor(1, context, initializer=init_worker, initargs=(self.bot,)) as model:
+            pending = set()
+            waiting = []
+            
+            def collect(futures):
+                for future in futures:
+                    pending.discard(future)
+                    for line, query, response, source, elapsed in future.result():
+                        if response is None:
+                            waiting.append((line, query))
+                            continue
+                        self.write(out, line, query, response, source, elapsed)
+                while len(waiting) >= self.batch_size:
+                    pending.add(model.submit(answer_model, waiting[:self.batch_size]))
+                    del waiting[:self.batch_size]
+            
+            chunk = []
+            for item in read_questions(input_path, done):
+                chunk.append(item)
+                if len(chunk) < self.chunk_size:
+                    continue
+                pending.add(rules.submit(answer_rules, chunk))
+                chunk = []
+                # Bound the work in flight so large logs stream through
+                if len(pending) >= 2 * self.workers + 2:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            if chunk:
+                pending.add(rules.submit(answer_rules, chunk))
+            
+            while pending:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+                if waiting and not pending:
+                    pending.add(model.submit(answer_model, list(waiting)))
+                    waiting.clear()
+        
+        elapsed = time.perf_counter() - start
+        answered = sum(self.counts.values())
+        return {
+            'answered': answered,
+            'skipped': len(done),
+            'elapsed_s': round(elapsed, 3),
+            'queries_per_s': round(answered / elapsed, 1) if elapsed else 0.0,
+            **self.counts
+        }
+    
+    def write(self, out, line, query, response, source, elapsed):
+        """Append one answer record and flush it so it survives an interruption."""
+        self.counts[source] += 1
+        record = {
+            'line': line,
+            'query': query,
+            'response': response,
+            'source': source,
+            'elapsed_ms': round(elapsed * 1000, 3)
+        }
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-answer a JSONL log of questions.")
+    parser.add_argument('input', help="JSONL file with one {\"query\": ...} per line")
+    parser.add_argument('output', help="JSONL file to append answers to")
+    parser.add_argument('--bot', choices=['simple', 'full'], default='simple')
+    parser.add_argument('--workers', type=int, default=None, help="rule-based worker processes (default: CPU count)")
+    parser.add_argument('--chunk-size', type=int, default=64, help="questions per rule-based task")
+    parser.add_argument('--batch-size', type=int, default=16, help="questions per model batch")
+    parser.add_argument('--no-resume', action='store_true', help="overwrite the output instead of resuming")
+    parser.add_argument('--preload', action='store_true', help="load the model once and fork workers that share it")
+    args = parser.parse_args()
+    
+    replay = BatchReplay(args.bot, args.workers, args.chunk_size, args.batch_size, args.preload)
+    stats = replay.run(args.input, args.output, resume=not args.no_resume)
+    print(f"✅ Answered {stats['answered']} questions in {stats['elapsed_s']}s "
+          f"({stats['queries_per_s']} q/s): {stats['rule']} rule-based, {stats['model']} model, "
+          f"{stats['error']} errors, {stats['unsupported']} unsupported; {stats['skipped']} already done")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""
+LRU cache for chatbot responses.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from metrics import count
+
+
+def normalize_query(query):
+    """Normalize question text into a cache key; other keys, such as tuples, are used as they are."""
+    if not isinstance(query, str):
+        return query
+    return re.sub(r"\s+", " ", query.casefold()).strip(" ?!.")
+
+
+class TransientResponse(str):
+    """A response that is never cached, such as an error or a fallback while the model is unavailable."""
+
+
+def next_midnight(now):
+    """Timestamp of the next local day boundary after now."""
+    tomorrow = datetime.fromtimestamp(now).date() + timedelta(days=1)
+    return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
+
+class ResponseCache:
+    def __init__(self, max_size=256, ttl=300):
+        """Initialize a cache holding at most max_size responses for ttl seconds."""
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, query, version):
+        """Return the cached response for a query, or None."""
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            # Entries are tied to the data version they were computed from
+            # and never outlive the day, since many answers are relative
+            # to today's date.
+            if entry is not None and (entry[1] != version or entry[2] <= time.time()):
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                count('cache.miss')
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        count('cache.hit')
+        return entry[0]
+    
+    def put(self, query, version, response):
+        """Cache a response computed against the given data version, unless it is transient."""
+        if self.max_size <= 0 or isinstance(response, TransientResponse):
+            return
+        now = time.time()
+        expires = min(now + self.ttl, next_midnight(now))
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = (response, version, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        """Drop every cached response."""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        """Return hit/miss counters and the current size."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries)
+        }
+    
+    def __len__(self):
+        return len(self._entries)
\ No newline at end of file
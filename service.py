@@ -0,0 +1,313 @@
+"""
+Asyncio service mode for the invoice chatbots.
+
+Rule-based questions are answered inline on the event loop. Questions
+that need a model are queued, grouped into micro-batches and run on a
+thread pool, so slow inference never stalls fast lookups.
+
+Serves JSON over HTTP (POST /query, GET /health, GET /metrics) or, with --unix, one
+JSON object per line over a Unix socket.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from intent_router import LISTINGS, PAGED, dispatch, route
+from invoice_listing import CURSOR_RE, CursorError, Listing
+from metrics import prometheus_text, registry
+from model_registry import models
+
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+
+class BadRequest(ValueError):
+    """A request the service cannot answer as asked; sent back with status 400."""
+
+
+def page_slots(request):
+    """A request's limit, offset and cursor, raising BadRequest if one is malformed."""
+    page = {}
+    for key in ('limit', 'offset'):
+        value = request.get(key)
+        if value is None:
+            continue
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise BadRequest(f"'{key}' must be a non-negative integer.")
+        page[key] = value
+    cursor = request.get('cursor')
+    if cursor is not None:
+        if not isinstance(cursor, str) or not CURSOR_RE.fullmatch(cursor):
+            raise BadRequest("'cursor' must be a cursor returned by an earlier answer.")
+        page['cursor'] = cursor
+    return page
+
+
+class MicroBatcher:
+    def __init__(self, handler, max_batch_size=16, max_wait=0.01, workers=1):
+        """Batch calls to handler, which maps a list of items to a list of results."""
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self.batches = 0
+        self.items = 0
+        self._queue = None
+        self._tasks = []
+    
+    def start(self):
+        """Start the batching tasks on the running event loop."""
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+    
+    async def stop(self):
+        """Stop the batching tasks and the thread pool."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+    
+    async def submit(self, item):
+        """Queue an item and wait for its result."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+    
+    async def _collect(self):
+        """Wait for one item, then gather more until the batch is full or max_wait passes."""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.handler, items)
+                error = None
+            except Exception as e:
+                results, error = [None] * len(batch), e
+            
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+
+class InvoiceService:
+    def __init__(self, bot, max_batch_size=16, max_wait=0.01, workers=1):
+        """Wrap a chatbot with an inline rule path and a batched model path."""
+        self.bot = bot
+        self.batcher = MicroBatcher(bot.answer_model_batch, max_batch_size, max_wait, workers)
+        self.started = time.time()
+        self.requests = {'rule': 0, 'model': 0, 'cache': 0, 'error': 0}
+    
+    async def answer(self, query, page=None):
+        """Answer a query, returning the response and where it came from.
+        
+        Listings are paged with page's limit, offset and cursor, and come
+        back as the Listing itself so its total and next cursor can be sent.
+        """
+        intent, slots = route(query)
+        if intent == 'exit':
+            return "Goodbye! Thanks for using the Invoice Chatbot.", 'rule'
+        if intent == 'more':
+            # The bot's last listing is shared by every client, so only a cursor can continue one
+            raise BadRequest("'more' is not supported here; repeat the question with the 'cursor' from its answer.")
+        if intent in PAGED:
+            if intent in LISTINGS:
+                slots = {**slots, **(page or {})}
+            return dispatch(self.bot, intent, slots, stream=True), 'rule'
+        
+        version = self.bot.parser.invoices.version
+        response = self.bot.response_cache.get(query, version)
+        if response is not None:
+            return response, 'cache'
+        
+        response = dispatch(self.bot, intent, slots)
+        source = 'rule'
+        if response is None:
+            response = await self.batcher.submit(query)
+            source = 'model'
+        self.bot.response_cache.put(query, version, response)
+        return response, source
+    
+    async def handle_request(self, request):
+        """Handle one decoded JSON request and return (status, payload)."""
+        query = request.get('query') if isinstance(request, dict) else None
+        if not isinstance(query, str) or not query.strip():
+            return 400, {'error': "Request must be a JSON object with a non-empty 'query' string."}
+        
+        start = time.perf_counter()
+        try:
+            response, source = await self.answer(query.strip(), page_slots(request))
+            listing = response if isinstance(response, Listing) else None
+            if listing is not None:
+                response = str(listing)
+        except (BadRequest, CursorError) as e:
+            self.requests['error'] += 1
+            return 400, {'error': str(e)}
+        except Exception as e:
+            self.requests['error'] += 1
+            return 500, {'error': f"Error processing query: {e}"}
+        
+        self.requests[source] += 1
+        payload = {
+            'query': query,
+            'response': response,
+            'source': source,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 3)
+        }
+        if listing is not None:
+            payload['total'] = listing.total
+            payload['cursor'] = listing.cursor
+        return 200, payload
+    
+    def stats(self):
+        """Return service counters."""
+        return {
+            'uptime_s': round(time.time() - self.started, 3),
+            'requests': dict(self.requests),
+            'batches': self.batcher.batches,
+            'batched_queries': self.batcher.items,
+            'cache': self.bot.response_cache.stats(),
+            'invoices': len(self.bot.parser.invoices),
+            'models': models.stats(),
+            'metrics': registry.snapshot()
+        }
+    
+    async def handle_http(self, reader, writer):
+        """Serve a single HTTP/1.1 request on a connection."""
+        try:
+            request_line = await reader.readline()
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length') or 0))
+            
+            if method == 'GET' and path == '/health':
+                status, payload = 200, self.stats()
+            elif method == 'GET' and path == '/metrics':
+                status, payload = 200, prometheus_text(registry.snapshot())
+            elif method == 'POST' and path == '/query':
+                try:
+                    request = json.loads(body or b'{}')
+                except ValueError:
+                    status, payload = 400, {'error': "Request body is not valid JSON."}
+                else:
+                    status, payload = await self.handle_request(request)
+            else:
+                status, payload = 404, {'error': f"No route for {method} {path}"}
+            
+            if isinstance(payload, str):
+                data, content_type = payload.encode('utf-8'), "text/plain; version=0.0.4"
+            else:
+                data, content_type = json.dumps(payload).encode('utf-8'), "application/json"
+            writer.write(
+                f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + data
+            )
+            await writer.drain()
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    
+    async def handle_jsonl(self, reader, writer):
+        """Serve newline-delimited JSON requests until the client disconnects."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    payload = {'error': "Request is not valid JSON."}
+                else:
+                    _, payload = await self.handle_request(request)
+                writer.write(json.dumps(payload).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    
+    async def serve(self, host='127.0.0.1', port=8080, unix_path=None):
+        """Run the service until cancelled."""
+        self.batcher.start()
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_jsonl, path=unix_path)
+            print(f"🤖 Invoice service listening on unix:{unix_path}")
+        else:
+            server = await asyncio.start_server(self.handle_http, host, port)
+            print(f"🤖 Invoice service listening on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the invoice chatbot over HTTP or a Unix socket.")
+    parser.add_argument('--bot', choices=['simple', 'full'], default='simple',
+                        help="simple: DistilBERT Q&A (default); full: DialoGPT generation")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--unix', help="serve newline-delimited JSON on this Unix socket path instead of HTTP")
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--max-wait-ms', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=1, help="concurrent inference batches")
+    parser.add_argument('--no-warm-up', action='store_true', help="load the model on first use instead of at startup")
+    args = parser.parse_args()
+    
+    if args.bot == 'simple':
+        from chatbot_simple import SimpleLLMChatbot
+        bot = SimpleLLMChatbot(warm_up=not args.no_warm_up)
+    else:
+        from chatbot import InvoiceChatbot
+        bot = InvoiceChatbot(warm_up=not args.no_warm_up)
+    
+    service = InvoiceService(bot, args.max_batch_size, args.max_wait_ms / 1000, args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        print("\nGoodbye! Invoice service stopped.")
+    finally:
+        bot.close()
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
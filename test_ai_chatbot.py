@@ -16,12 +16,12 @@ def test_ai_chatbot():
         "What is the total value of the invoice from Amazon?",
         "List all vendors with invoices above $2,000",
         "Show me all invoices",
-        
-        # Natural language queries (will use AI model)
         "Which vendor has the highest invoice?",
-        "What's Microsoft's invoice number?",
         "Who owes the most money?",
         "Which company has the earliest due date?",
+        
+        # Natural language queries (will use AI model)
+        "What's Microsoft's invoice number?",
         "What invoices are from tech companies?",
     ]
     
@@ -34,7 +34,7 @@ def test_ai_chatbot():
         print(f"   A: {response}")
         
         # Add separator for readability
-        if i == 4:
+        if i == 7:
             print("\n" + "─" * 40 + " AI Model Queries " + "─" * 40)
     
     print("\n" + "=" * 60)
@@ -43,5 +43,29 @@ def test_ai_chatbot():
     print("Rule-based queries are processed faster without AI.")
 
 
+def test_ai_chatbot_batch():
+    """Test answering a batch of queries in one call."""
+    bot = SimpleLLMChatbot()
+    
+    test_queries = [
+        "Show me all invoices",
+        "Which vendor has the highest invoice?",
+        "What is the total value of the invoice from Microsoft?",
+        "What's Google's invoice number?",
+    ]
+    
+    print("🧪 Testing Batched Queries")
+    print("=" * 60)
+    
+    responses = bot.process_queries(test_queries, batch_size=2)
+    for i, (query, response) in enumerate(zip(test_queries, responses), 1):
+        print(f"\n{i}. Q: {query}")
+        print(f"   A: {response}")
+    
+    print("\n" + "=" * 60)
+    print("✅ Batch test completed!")
+
+
 if __name__ == "__main__":
-    test_ai_chatbot()
\ No newline at end of file
+    test_ai_chatbot()
+    test_ai_chatbot_batch()
\ No newline at end of file
@@ -2,7 +2,15 @@
 Test script to demonstrate the chatbot functionality.
 """
 
+import os
+import random
+import tempfile
+from datetime import date, timedelta
 from chatbot import InvoiceChatbot
+from invoice_parser import InvoiceParser
+from invoice_shards import ShardedInvoiceParser, shard_of
+from invoice_snapshot import SnapshotError, load_snapshot, write_snapshot
+from invoice_store import InvoiceStore
 
 
 def test_chatbot():
@@ -15,7 +23,10 @@ def test_chatbot():
         "List all vendors with invoices > $2,000",
         "Show me all invoices",
         "What invoices are overdue?",
-        "How many invoices are due in the next 30 days?"
+        "How many invoices are due in the next 30 days?",
+        "Show me the top 2 invoices",
+        "How much do I owe altogether?",
+        "More"
     ]
     
     print("🧪 Testing Invoice Chatbot")
@@ -30,5 +41,209 @@ def test_chatbot():
     print("✅ Test completed!")
 
 
+def random_invoice(rng, vendors, number):
+    """A random invoice due within about six weeks of today."""
+    due = date.today() + timedelta(days=rng.randint(-40, 50))
+    return {
+        "vendor": rng.choice(vendors),
+        "invoice_number": f"INV-{number:04d}",
+        "invoice_date": str(due - timedelta(days=rng.randint(0, 10))),
+        "due_date": str(due),
+        "total": rng.choice([round(rng.uniform(10, 5000), 2), 100.0]),
+        "paid": rng.random() < 0.3
+    }
+
+
+def parser_answers(parser, vendor_order=True):
+    """Answers to every kind of parser query, with invoices as row positions.
+    
+    Without vendor_order, a vendor's invoices are compared as a set: a
+    parser catching up with edits made elsewhere may order them differently.
+    """
+    rows = lambda invoices: [invoice.row for invoice in invoices]
+    today = date.today()
+    answers = [
+        parser.get_ledger_summary(), list(parser.get_vendor_totals().items()),
+        {period: parser.get_due_buckets(period) for period in ("day", "week", "month")},
+        rows(parser.get_overdue_invoices()), rows(parser.get_top_invoices(7)),
+        rows(parser.get_invoices_above_amount(99.99)), rows(parser.get_invoices_due_in_days(9)),
+        rows(parser.get_invoices_due_between(today, today + timedelta(days=20)))
+    ]
+    for field in ("total", "due_date", "invoice_date"):
+        for largest in (True, False):
+            answers.append(rows(parser.get_ranked_invoices(field, 3, largest)))
+            answers.append(rows(parser.get_ranked_invoices(field, 3, largest, vendor_name="AMAZON")))
+    for by in ("total", "open_balance", "count"):
+        answers.append(parser.get_ranked_vendors(by, 3))
+    for vendor in ("Amazon", "Google", "Initech", "Nobody"):
+        vendor_rows = rows(parser.get_invoices_by_vendor(vendor))
+        answers.append(vendor_rows if vendor_order else sorted(vendor_rows))
+        answers.append(parser.get_vendor_summary(vendor))
+    return answers
+
+
+def test_sharded_parser():
+    """Test that a sharded parser answers like a single-process one while invoices change."""
+    rng = random.Random(7)
+    vendors = ["Amazon", "amazon", "Google", "Microsoft", "Acme Co", "Globex", "Initech", "Umbrella"]
+    invoices = [random_invoice(rng, vendors, i) for i in range(200)]
+    parser = InvoiceParser(InvoiceStore(invoices))
+    sharded = ShardedInvoiceParser(InvoiceStore(invoices), shards=3)
+    
+    print("🧪 Testing Sharded Invoice Parser")
+    print("=" * 50)
+    
+    try:
+        # The last invoice of a shard moving to another shard and back
+        row = len(invoices) - 1
+        vendor = invoices[row]["vendor"]
+        away = next(v for v in vendors if shard_of(v.casefold(), 3) != shard_of(vendor.casefold(), 3))
+        for changes in ({"vendor": away}, {"vendor": vendor}, {"total": 5}):
+            parser.update_invoice(row, **changes)
+            sharded.update_invoice(row, **changes)
+        
+        # A bad value changes nothing
+        for p in (parser, sharded):
+            try:
+                p.update_invoice(0, vendor=away, due_date="not a date")
+            except ValueError:
+                pass
+        assert parser_answers(parser) == parser_answers(sharded)
+        
+        number = len(invoices)
+        for step in range(300):
+            row = rng.choice(list(parser.invoices.live_rows()))
+            op = rng.random()
+            if op < 0.2:
+                batch = [random_invoice(rng, vendors, number + i) for i in range(rng.randint(1, 5))]
+                number += len(batch)
+                for p in (parser, sharded):
+                    p.add_invoices(batch)
+            elif op < 0.35:
+                for p in (parser, sharded):
+                    p.delete_invoice(row)
+            elif op < 0.5:
+                paid = rng.random() < 0.7
+                for p in (parser, sharded):
+                    p.mark_paid(row, paid)
+            else:
+                invoice = random_invoice(rng, vendors, 0)
+                fields = rng.sample(["vendor", "due_date", "invoice_date", "total", "paid"], rng.randint(1, 3))
+                for p in (parser, sharded):
+                    p.update_invoice(row, **{field: invoice[field] for field in fields})
+            if step % 20 == 0:
+                assert parser_answers(parser) == parser_answers(sharded), f"answers differ after step {step}"
+        assert parser_answers(parser) == parser_answers(sharded)
+    finally:
+        sharded.close()
+    
+    print(f"{len(parser.invoices)} invoices, {len(parser.invoices.deleted)} deleted, answers identical")
+    print("\n" + "=" * 50)
+    print("✅ Test completed!")
+
+
+def test_shared_store():
+    """Test that parsers sharing a store answer alike whichever of them changes it."""
+    rng = random.Random(11)
+    vendors = ["Amazon", "amazon", "Google", "Microsoft", "Acme Co", "Globex", "Initech", "Umbrella"]
+    invoices = [random_invoice(rng, vendors, i) for i in range(200)]
+    reference = InvoiceParser(InvoiceStore(invoices))
+    store = InvoiceStore(invoices)
+    shared = [InvoiceParser(store), InvoiceParser(store), ShardedInvoiceParser(store, shards=2)]
+    
+    print("🧪 Testing Parsers Sharing a Store")
+    print("=" * 50)
+    
+    try:
+        number = len(invoices)
+        for step in range(300):
+            row = rng.choice(list(reference.invoices.live_rows()))
+            # The others only see the change when they next answer or edit
+            editor = rng.choice(shared)
+            op = rng.random()
+            if op < 0.2:
+                batch = [random_invoice(rng, vendors, number + i) for i in range(rng.randint(1, 5))]
+                number += len(batch)
+                for p in (reference, editor):
+                    p.add_invoices(batch)
+            elif op < 0.35:
+                for p in (reference, editor):
+                    p.delete_invoice(row)
+            elif op < 0.5:
+                paid = rng.random() < 0.7
+                for p in (reference, editor):
+                    p.mark_paid(row, paid)
+            else:
+                invoice = random_invoice(rng, vendors, 0)
+                fields = rng.sample(["vendor", "due_date", "invoice_date", "total", "paid"], rng.randint(1, 3))
+                for p in (reference, editor):
+                    p.update_invoice(row, **{field: invoice[field] for field in fields})
+            if step % 7 == 0:
+                expected = parser_answers(reference, vendor_order=False)
+                for i, parser in enumerate(shared):
+                    assert parser_answers(parser, vendor_order=False) == expected, f"parser {i} is stale after step {step}"
+        
+        expected = parser_answers(reference, vendor_order=False)
+        assert all(parser_answers(parser, vendor_order=False) == expected for parser in shared)
+    finally:
+        shared[2].close()
+    
+    print(f"{len(store)} invoices, {len(store.deleted)} deleted, every parser up to date")
+    print("\n" + "=" * 50)
+    print("✅ Test completed!")
+
+
+def test_snapshot_round_trip():
+    """Test that a parser over a loaded snapshot answers like the one it was written from."""
+    rng = random.Random(3)
+    vendors = ["Amazon", "amazon", "Google", "Microsoft", "Acme Co", "Globex", "Initech", "Umbrella"]
+    invoices = [random_invoice(rng, vendors, i) for i in range(150)]
+    invoices[5]["notes"] = "Net 30"
+    parser = InvoiceParser(InvoiceStore(invoices))
+    parser.update_invoice(10, vendor="Globex", total=12.5)
+    parser.delete_invoice(20)
+    
+    print("🧪 Testing Invoice Snapshots")
+    print("=" * 50)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "invoices.snap")
+        write_snapshot(parser, path, "source")
+        store = load_snapshot(path, "source", verify=True)
+        loaded = InvoiceParser(store)
+        assert parser_answers(loaded) == parser_answers(parser)
+        assert dict(store[5]) == dict(parser.invoices[5])
+        assert store.invoice_numbers[-1] == invoices[-1]["invoice_number"]
+        assert 20 in store.deleted
+        
+        # The loaded store takes edits and appends like any other
+        for p in (parser, loaded):
+            p.add_invoice(random_invoice(random.Random(1), vendors, 150))
+            p.update_invoice(0, invoice_number="INV-X", paid=True)
+        assert parser_answers(loaded) == parser_answers(parser)
+        assert store.invoice_numbers[0] == "INV-X" and store.invoice_numbers[-1] == "INV-0150"
+        
+        for fingerprint, corrupt in (("other source", False), ("source", True)):
+            if corrupt:
+                with open(path, "r+b") as f:
+                    f.seek(-1, os.SEEK_END)
+                    byte = f.read(1)
+                    f.seek(-1, os.SEEK_END)
+                    f.write(bytes([byte[0] ^ 0xFF]))
+            try:
+                load_snapshot(path, fingerprint, verify=True)
+            except SnapshotError:
+                pass
+            else:
+                raise AssertionError("a bad snapshot was loaded")
+    
+    print(f"{len(store)} invoices written and loaded, answers identical")
+    print("\n" + "=" * 50)
+    print("✅ Test completed!")
+
+
 if __name__ == "__main__":
-    test_chatbot()
\ No newline at end of file
+    test_chatbot()
+    test_sharded_parser()
+    test_shared_store()
+    test_snapshot_round_trip()
\ No newline at end of file